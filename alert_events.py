@@ -0,0 +1,145 @@
+# alert_events.py
+import hashlib
+
+# Порядок важности: если на одной локации несколько тревог разных типов, в состоянии остаётся первая по списку
+ALERT_TYPE_PRIORITY = ("air_raid", "artillery_shelling", "urban_fights", "chemical", "nuclear")
+
+
+class AlertEvent:
+    """Изменение по одной локации: начало ("start"), отбой ("end") или смена типа ("type_change")."""
+
+    __slots__ = ('kind', 'uid', 'title', 'location_type', 'oblast', 'alert_type', 'previous_type')
+
+    def __init__(self, kind, uid, title, location_type, oblast, alert_type, previous_type=None):
+        self.kind = kind
+        self.uid = uid
+        self.title = title
+        self.location_type = location_type
+        self.oblast = oblast
+        self.alert_type = alert_type
+        self.previous_type = previous_type
+
+    @property
+    def region(self) -> str:
+        """Название для подстановки в шаблон {region}."""
+        if self.location_type in ("oblast", "city") or self.title == self.oblast:
+            return self.title
+        return f"{self.title} ({self.oblast})"
+
+    def __repr__(self):
+        return f"AlertEvent({self.kind}, {self.uid}, {self.title}, {self.alert_type})"
+
+
+def _type_rank(alert_type):
+    try: return ALERT_TYPE_PRIORITY.index(alert_type)
+    except ValueError: return len(ALERT_TYPE_PRIORITY)
+
+
+def parse_alerts(payload: dict, location_types) -> dict:
+    """Строит состояние {location_uid: (title, alert_type, location_type, oblast)} из ответа API."""
+    state = {}
+    for alert in payload.get("alerts", []):
+        location_type = alert.get("location_type") or "oblast"
+        if location_type not in location_types:
+            continue
+        title = alert["location_title"]
+        uid = str(alert.get("location_uid") or title)
+        record = (title, alert["alert_type"], location_type, alert.get("location_oblast") or title)
+        current = state.get(uid)
+        if current is None or _type_rank(record[1]) < _type_rank(current[1]):
+            state[uid] = record
+    return state
+
+
+def restore_state(snapshot) -> dict | None:
+    """Приводит сохранённое в JSON состояние к виду parse_alerts. None — если формат старый или битый."""
+    if not isinstance(snapshot, dict):
+        return None
+    if not all(isinstance(record, (list, tuple)) and len(record) == 4 for record in snapshot.values()):
+        return None
+    return {uid: tuple(record) for uid, record in snapshot.items()}
+
+
+def diff_alerts(previous: dict, actual: dict) -> list[AlertEvent]:
+    # Сравнение пар (uid, запись) делается на уровне множеств, поэтому Python-код
+    # выполняется только для изменившихся записей
+    events = []
+    for uid, (title, alert_type, location_type, oblast) in actual.items() - previous.items():
+        before = previous.get(uid)
+        if before is None:
+            events.append(AlertEvent("start", uid, title, location_type, oblast, alert_type))
+        elif before[1] != alert_type:
+            events.append(AlertEvent("type_change", uid, title, location_type, oblast, alert_type, before[1]))
+    for uid in previous.keys() - actual.keys():
+        title, alert_type, location_type, oblast = previous[uid]
+        events.append(AlertEvent("end", uid, title, location_type, oblast, alert_type))
+    return events
+
+
+class ChangeCoalescer:
+    """Сглаживает «мигающие» тревоги: изменения копятся в течение окна и рассылаются одним циклом.
+
+    announced — состояние, о котором уже знают подписчики, observed — последнее полученное из API.
+    Рассылается разница между ними, поэтому тревога, начавшаяся и закончившаяся внутри окна,
+    или отбой, за которым снова пришла тревога, не дают ни одного события.
+    """
+
+    def __init__(self, window: float, hold_starts: bool, on_suppressed=None):
+        self.window = window
+        self.hold_starts = hold_starts
+        self.on_suppressed = on_suppressed   # (kind, count) для событий, которые не ушли подписчикам
+        self.announced = {}
+        self.observed = {}
+        self._raw = {}                       # kind -> число изменений, увиденных с начала цикла
+        self._cycle_started = None
+
+    def reset(self, state: dict):
+        self.announced = self.observed = state
+        self._raw = {}
+        self._cycle_started = None
+
+    def update(self, observed: dict, now: float) -> list[AlertEvent]:
+        """Принимает новое состояние из API и возвращает события, которые пора разослать."""
+        for event in diff_alerts(self.observed, observed):
+            self._raw[event.kind] = self._raw.get(event.kind, 0) + 1
+        self.observed = observed
+        return self.flush_due(now)
+
+    def flush_due(self, now: float) -> list[AlertEvent]:
+        """Возвращает накопленные события, если окно истекло (вызывается и когда API ответил 304)."""
+        events = diff_alerts(self.announced, self.observed)
+        if events:
+            if self._cycle_started is None:
+                self._cycle_started = now
+            # Новая тревога или смена её типа не ждут окна, если это не разрешено явно;
+            # накопленные изменения уходят вместе с ними
+            urgent = not self.hold_starts and any(event.kind != "end" for event in events)
+            if not urgent and now - self._cycle_started < self.window:
+                return []
+        self._count_suppressed(events)
+        self.announced = self.observed
+        self._raw = {}
+        self._cycle_started = None
+        return events
+
+    def _count_suppressed(self, events):
+        if not self._raw or self.on_suppressed is None:
+            return
+        sent = {}
+        for event in events:
+            sent[event.kind] = sent.get(event.kind, 0) + 1
+        for kind, count in self._raw.items():
+            if count > sent.get(kind, 0):
+                self.on_suppressed(kind, count - sent.get(kind, 0))
+
+
+def wave_key(saved_at, actual: dict) -> str:
+    """Идентификатор волны для ключей идемпотентности outbox.
+
+    Зависит от времени сохранения предыдущего состояния и нового состояния, поэтому волна,
+    повторённая после перезапуска посреди рассылки, получает тот же ключ.
+    """
+    digest = hashlib.blake2b(repr(saved_at).encode(), digest_size=12)
+    for uid, record in sorted(actual.items()):
+        digest.update(repr((uid, record)).encode())
+    return digest.hexdigest()
@@ -0,0 +1,110 @@
+# benchmarks/fake_servers.py
+"""Локальные заглушки внешних сервисов для нагрузочных прогонов: API тревог и Telegram Bot API."""
+import asyncio
+import itertools
+import json
+import time
+from collections import deque
+
+from aiohttp import web
+
+
+class FakeAlertsAPI:
+    """Отдаёт заранее заданные «волны» тревог; advance() переключает на следующую волну."""
+
+    def __init__(self, waves: list[list[dict]]):
+        self.waves = waves
+        self.index = 0
+        self.served_at = {}      # номер волны -> время первой отдачи (time.monotonic)
+        self.requests = 0
+
+    def advance(self):
+        self.index = min(self.index + 1, len(self.waves) - 1)
+
+    async def handle(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        etag = f'"wave-{self.index}"'
+        if request.headers.get("If-None-Match") == etag:
+            return web.Response(status=304)
+        self.served_at.setdefault(self.index, time.monotonic())
+        body = json.dumps({"alerts": self.waves[self.index]}, ensure_ascii=False)
+        return web.Response(text=body, content_type="application/json", headers={"ETag": etag})
+
+    def routes(self):
+        return [web.get("/v1/alerts/active.json", self.handle)]
+
+
+class FakeTelegramAPI:
+    """Минимальный Bot API: принимает sendMessage/sendPhoto и отвечает 429 при превышении лимитов."""
+
+    def __init__(self, global_rate: float = 30, per_chat_rate: float = 1, latency: float = 0.0):
+        self.global_rate = global_rate
+        self.per_chat_rate = per_chat_rate
+        self.latency = latency
+        self.deliveries = []      # (time.monotonic, chat_id, method)
+        self.rejected = 0
+        self.uploads = 0
+        self._message_ids = itertools.count(1)
+        self._global_window = deque()
+        self._chat_last = {}
+
+    def _check_limits(self, chat_id: int, now: float) -> float:
+        """Возвращает 0, если запрос укладывается в лимиты, иначе сколько секунд ждать."""
+        while self._global_window and now - self._global_window[0] >= 1:
+            self._global_window.popleft()
+        if len(self._global_window) >= self.global_rate:
+            return 1 - (now - self._global_window[0])
+        # Небольшой допуск: Telegram не считает лимиты с точностью до миллисекунд
+        last = self._chat_last.get(chat_id)
+        if last is not None and now - last < 1 / self.per_chat_rate - 0.05:
+            return 1 / self.per_chat_rate - (now - last)
+        self._global_window.append(now)
+        self._chat_last[chat_id] = now
+        return 0
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        data = await request.post()
+        if method == "getMe":
+            return web.json_response({"ok": True, "result": {"id": 1, "is_bot": True, "first_name": "bench"}})
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        chat_id = int(data["chat_id"])
+        wait = self._check_limits(chat_id, time.monotonic())
+        if wait:
+            self.rejected += 1
+            retry_after = max(1, round(wait))
+            return web.json_response({
+                "ok": False, "error_code": 429,
+                "description": f"Too Many Requests: retry after {retry_after}",
+                "parameters": {"retry_after": retry_after},
+            }, status=429)
+
+        self.deliveries.append((time.monotonic(), chat_id, method))
+        result = {"message_id": next(self._message_ids), "date": int(time.time()),
+                  "chat": {"id": chat_id, "type": "channel"}}
+        if method == "sendPhoto":
+            # aiogram передаёт загружаемый файл отдельной частью и ссылается на неё как attach://...
+            photo = data.get("photo")
+            if not isinstance(photo, str) or photo.startswith("attach://"):
+                self.uploads += 1
+            result["photo"] = [{"file_id": "bench-photo", "file_unique_id": "bench", "width": 1, "height": 1}]
+            result["caption"] = data.get("caption", "")
+        else:
+            result["text"] = data.get("text", "")
+        return web.json_response({"ok": True, "result": result})
+
+    def routes(self):
+        return [web.post("/bot{token}/{method}", self.handle)]
+
+
+async def start_server(routes, host: str = "127.0.0.1", port: int = 0) -> tuple[web.AppRunner, str]:
+    app = web.Application(client_max_size=32 * 1024 * 1024)
+    app.add_routes(routes)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    bound_port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://{host}:{bound_port}"
@@ -0,0 +1,189 @@
+# benchmarks/load_test.py
+"""Сквозной нагрузочный прогон: фейковый API тревог -> check_alerts -> рассылка -> фейковый Telegram.
+
+Запуск из корня репозитория:
+    python -m benchmarks.load_test --channels 10000 --global-rate 30
+
+Печатает по каждой волне время до последнего доставленного сообщения, p50/p99 задержки
+от обнаружения до доставки и скорость отправки.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import tempfile
+import time
+
+from aiogram import Bot
+from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+
+import config
+import database as db
+import main
+from alert_events import diff_alerts, parse_alerts
+from delivery import DeliveryEngine
+from regions import UKRAINE_REGIONS
+
+from benchmarks.fake_servers import FakeAlertsAPI, FakeTelegramAPI, start_server
+from benchmarks.synthetic_db import make_database
+
+# 1x1 PNG, чтобы не запускать браузер ради скриншота
+_TINY_PNG = bytes.fromhex(
+    "89504e470d0a1a0a0000000d4948445200000001000000010806000000"
+    "1f15c4890000000d49444154789c6360000002000154a24f5d0000000049454e44ae426082"
+)
+
+
+def _alert(index: int, alert_type: str) -> dict:
+    return {"location_title": UKRAINE_REGIONS[index], "location_uid": str(index),
+            "location_type": "oblast", "alert_type": alert_type}
+
+
+def default_waves(seed: int = 1) -> list[list[dict]]:
+    """Базовое пустое состояние, массовое начало тревог, частичный отбой со сменой типов, общий отбой."""
+    rng = random.Random(seed)
+    regions = rng.sample(range(len(UKRAINE_REGIONS)), 15)
+    wave_start = [_alert(i, "air_raid") for i in regions[:12]] + [_alert(i, "artillery_shelling") for i in regions[12:]]
+    wave_mixed = [_alert(i, "artillery_shelling") for i in regions[:3]] + [_alert(i, "air_raid") for i in regions[3:6]]
+    return [[], wave_start, wave_mixed, []]
+
+
+def percentile(values: list[float], share: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(share * (len(ordered) - 1))))]
+
+
+def expected_deliveries(previous: list[dict], actual: list[dict]) -> tuple[int, int]:
+    """Сколько сообщений должна отправить волна: (основные, ответы с картой в режиме text_first)."""
+    location_types = config.ALERT_LOCATION_TYPES
+    events = diff_alerts(parse_alerts({"alerts": previous}, location_types), parse_alerts({"alerts": actual}, location_types))
+    per_event = [{channel['channel_id'] for channel in db.subscriptions.subscribers(event.oblast)} for event in events]
+    chats = set().union(*per_event) if per_event else set()
+    primary = len(chats) if config.DIGEST_MODE else sum(len(channels) for channels in per_event)
+    followups = len(chats) if config.NOTIFICATION_MODE == "text_first" else 0
+    return primary, followups
+
+
+async def fake_screenshot(path: str, alerts_state: dict) -> str:
+    with open(path, "wb") as file:
+        file.write(_TINY_PNG)
+    return path
+
+
+async def no_screenshot(path: str, alerts_state: dict) -> None:
+    return None
+
+
+async def run(args) -> dict:
+    workdir = tempfile.mkdtemp(prefix="borik-bench-")
+    os.chdir(workdir)
+    make_database(os.path.join(workdir, "bot_database.db"), args.channels, seed=args.seed)
+
+    waves = default_waves(args.seed)
+    if args.waves:
+        with open(args.waves, encoding="utf-8") as file:
+            waves = json.load(file)
+
+    alerts_api = FakeAlertsAPI(waves)
+    telegram = FakeTelegramAPI(args.telegram_global_rate, args.telegram_chat_rate, args.telegram_latency)
+    api_runner, api_url = await start_server(alerts_api.routes())
+    telegram_runner, telegram_url = await start_server(telegram.routes())
+
+    config.ALERTS_API_URL = f"{api_url}/v1/alerts/active.json"
+    config.POLL_INTERVAL = args.poll_interval
+    config.ALERT_COALESCE_WINDOW = args.coalesce_window
+    config.NOTIFICATION_MODE = args.mode
+    config.DIGEST_MODE = args.digest
+    main.bot = Bot(config.BOT_TOKEN, session=AiohttpSession(api=TelegramAPIServer.from_base(telegram_url)),
+                   default=DefaultBotProperties(parse_mode="HTML"))
+    main.delivery = DeliveryEngine(args.workers, args.global_rate, args.chat_rate, config.DELIVERY_MAX_RETRIES)
+    if args.screenshot == "file":
+        main.take_alert_map = fake_screenshot
+    elif args.screenshot == "none":
+        main.take_alert_map = no_screenshot
+    else:
+        config.MAP_RENDERER = args.screenshot
+
+    await db.init_db()
+    main.delivery.start()
+    poller_task = asyncio.create_task(main.check_alerts("baseline"))
+    while not alerts_api.served_at:
+        await asyncio.sleep(0.01)
+    await asyncio.sleep(args.poll_interval * 2)
+
+    report = {"channels": args.channels, "waves": []}
+    primary_method = "sendMessage" if args.mode == "text_first" or args.screenshot == "none" else "sendPhoto"
+    for wave in range(1, len(waves)):
+        primary, followups = expected_deliveries(waves[wave - 1], waves[wave])
+        first_index, rejected_before = len(telegram.deliveries), telegram.rejected
+        alerts_api.advance()
+        deadline = time.monotonic() + args.timeout
+        while len(telegram.deliveries) - first_index < primary + followups and time.monotonic() < deadline:
+            await asyncio.sleep(0.02)
+
+        served_at = alerts_api.served_at.get(wave, time.monotonic())
+        wave_deliveries = telegram.deliveries[first_index:]
+        latencies = [at - served_at for at, _, method in wave_deliveries if method == primary_method]
+        duration = (wave_deliveries[-1][0] - served_at) if wave_deliveries else 0.0
+        report["waves"].append({
+            "wave": wave,
+            "expected": primary + followups,
+            "delivered": len(wave_deliveries),
+            "completion_s": round(duration, 3),
+            "p50_s": round(percentile(latencies, 0.5), 3),
+            "p99_s": round(percentile(latencies, 0.99), 3),
+            "sends_per_s": round(len(wave_deliveries) / duration, 1) if duration else 0.0,
+            "rejected_429": telegram.rejected - rejected_before,
+        })
+
+    poller_task.cancel()
+    await main.delivery.stop()
+    await main.bot.session.close()
+    await db.close_db()
+    await api_runner.cleanup()
+    await telegram_runner.cleanup()
+    report["uploads"] = telegram.uploads
+    return report
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Нагрузочний прогін check_alerts і розсилки")
+    parser.add_argument("--channels", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--waves", help="JSON-файл зі списком хвиль (кожна — список тривог у форматі API)")
+    parser.add_argument("--mode", choices=("map_first", "text_first"), default=config.NOTIFICATION_MODE)
+    parser.add_argument("--digest", action="store_true", default=config.DIGEST_MODE)
+    parser.add_argument("--screenshot", choices=("file", "native", "browser", "none"), default="file")
+    parser.add_argument("--workers", type=int, default=config.DELIVERY_WORKERS)
+    parser.add_argument("--global-rate", type=float, default=config.GLOBAL_RATE_LIMIT)
+    parser.add_argument("--chat-rate", type=float, default=config.PER_CHAT_RATE_LIMIT)
+    parser.add_argument("--telegram-global-rate", type=float, default=30)
+    parser.add_argument("--telegram-chat-rate", type=float, default=1)
+    parser.add_argument("--telegram-latency", type=float, default=0.0, help="Затримка відповіді фейкового Telegram, с")
+    parser.add_argument("--poll-interval", type=float, default=0.5)
+    parser.add_argument("--coalesce-window", type=float, default=0.0,
+                        help="Вікно згладжування змін, с (0 — кожна хвиля розсилається одразу, як очікує звіт)")
+    parser.add_argument("--timeout", type=float, default=3600, help="Максимальний час очікування однієї хвилі, с")
+    parser.add_argument("--output", help="Зберегти звіт у JSON")
+    args = parser.parse_args()
+    # run() переходит во временный каталог, поэтому пути из аргументов делаем абсолютными
+    args.waves = args.waves and os.path.abspath(args.waves)
+    args.output = args.output and os.path.abspath(args.output)
+
+    report = asyncio.run(run(args))
+    for wave in report["waves"]:
+        print(f"Хвиля {wave['wave']}: {wave['delivered']}/{wave['expected']} повідомлень за {wave['completion_s']} с, "
+              f"p50 {wave['p50_s']} с, p99 {wave['p99_s']} с, {wave['sends_per_s']} повідомлень/с, "
+              f"429: {wave['rejected_429']}")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(report, file, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,360 @@
+# benchmarks/micro.py
+"""Микробенчмарки горячих функций бота: разбор и сравнение ответа API, маршрутизация и шаблоны рассылки,
+клавиатура регионов и все функции database.py на базе реалистичного размера.
+
+Запуск из корня репозитория (сеть не нужна, Telegram заменён заглушкой):
+    python -m benchmarks.micro                     # напечатать результаты
+    python -m benchmarks.micro --save              # перезаписать benchmarks/baseline.json
+    python -m benchmarks.micro --compare           # сравнить с benchmarks/baseline.json
+
+Для каждой функции печатается медиана и минимум времени одного вызова по нескольким раундам.
+Раунды собираются за несколько проходов, каждый на свежей базе: короткий всплеск нагрузки на машине
+портит только один проход, а outbox в начале каждого прохода одного и того же размера.
+
+--compare сравнивает минимумы. На свободной машине они расходятся между запусками до ±8%, у функций
+дешевле микросекунды — на ±0.1 мкс, и такая разница замедлением не считается. На общей виртуальной машине
+отдельные бенчмарки, а то и весь запуск, бывают медленнее на 30-40%: поэтому всё, что превысило порог
+(по умолчанию 25%), перемеряется ещё --confirm раз, и замедлением считается только повторившееся.
+Медиана гуляет сильнее минимума и в сравнении не участвует. Базовую линию (--save) лучше снимать
+на свободной машине: завышенная базовая линия прячет настоящие замедления.
+"""
+import argparse
+import asyncio
+import gc
+import itertools
+import json
+import logging
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+import config
+import database as db
+import main
+from alert_events import AlertEvent, diff_alerts, parse_alerts
+from delivery import DeliveryEngine
+from regions import UKRAINE_REGIONS, regions_to_mask
+
+from benchmarks.synthetic_db import make_database
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+# Раунд длится не меньше этого времени, число вызовов в раунде подбирается само
+ROUND_SECONDS = 0.05
+MAX_NUMBER = 100000
+# Разница меньше этой (мкс) — погрешность вызова корутины и таймера, а не замедление
+MIN_DIFFERENCE_US = 0.1
+
+
+class StubBot:
+    """Заглушка aiogram.Bot: «отправляет» мгновенно и возвращает объект, похожий на Message."""
+
+    def __init__(self):
+        self.sent = 0
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.sent += 1
+        return SimpleNamespace(chat=SimpleNamespace(id=chat_id), message_id=self.sent)
+
+
+class MemoryOutbox:
+    """Outbox без базы данных, чтобы маршрутизация и шаблоны мерились отдельно от SQLite."""
+
+    async def enqueue(self, rows):
+        return rows
+
+    def record_result(self, key, future):
+        pass
+
+    async def flush(self):
+        pass
+
+
+def alerts_payload(rng: random.Random, raions_per_oblast: int = 5, share: float = 0.5) -> dict:
+    """Ответ API в формате alerts.in.ua: часть областей целиком и районы остальных."""
+    alerts = []
+    for oblast in UKRAINE_REGIONS:
+        if rng.random() < share / 2:
+            alerts.append({"location_title": oblast, "location_uid": f"o-{oblast}", "location_type": "oblast",
+                           "location_oblast": oblast, "alert_type": "air_raid"})
+            continue
+        for index in range(raions_per_oblast):
+            if rng.random() < share:
+                alert_type = "air_raid" if rng.random() < 0.8 else "artillery_shelling"
+                alerts.append({"location_title": f"Район {index} ({oblast})", "location_uid": f"r-{oblast}-{index}",
+                               "location_type": "raion", "location_oblast": oblast, "alert_type": alert_type})
+    return {"alerts": alerts}
+
+
+def changed_payload(payload: dict, rng: random.Random, share: float = 0.1) -> dict:
+    """Та же волна, где примерно share тревог закончилась и столько же новых началось."""
+    alerts = [alert for alert in payload["alerts"] if rng.random() >= share]
+    added = int(len(payload["alerts"]) * share) or 1
+    for index in range(added):
+        oblast = rng.choice(UKRAINE_REGIONS)
+        alerts.append({"location_title": f"Громада {index} ({oblast})", "location_uid": f"h-{oblast}-{index}",
+                       "location_type": "hromada", "location_oblast": oblast, "alert_type": "air_raid"})
+    return {"alerts": alerts}
+
+
+async def measure(func, repeat: int) -> tuple[list[float], int]:
+    """Время одного вызова func() в секундах для каждого из repeat раундов и число вызовов в раунде."""
+    started = time.perf_counter()
+    await func()
+    first = time.perf_counter() - started
+    number = getattr(func, "number", None) or max(1, min(MAX_NUMBER, int(ROUND_SECONDS / first) if first else MAX_NUMBER))
+    rounds = []
+    # Как в timeit: сборщик мусора внутри раунда даёт случайные выбросы в десятки процентов
+    gc.collect()
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            started = time.perf_counter()
+            for _ in range(number):
+                await func()
+            rounds.append((time.perf_counter() - started) / number)
+    finally:
+        gc.enable()
+    return rounds, number
+
+
+def summarize(rounds: list[float], number: int) -> dict:
+    return {"median_us": round(statistics.median(rounds) * 1e6, 2), "min_us": round(min(rounds) * 1e6, 2),
+            "number": number}
+
+
+def _sync(func, *args):
+    async def call():
+        func(*args)
+    return call
+
+
+def _async(func, *args):
+    async def call():
+        await func(*args)
+    return call
+
+
+async def alert_benchmarks(rng: random.Random) -> list:
+    payload = alerts_payload(rng)
+    previous = parse_alerts(payload, config.ALERT_LOCATION_TYPES)
+    actual = parse_alerts(changed_payload(payload, rng), config.ALERT_LOCATION_TYPES)
+    same = dict(previous)
+    return [
+        (f"alerts.parse_alerts[{len(payload['alerts'])}]", _sync(parse_alerts, payload, config.ALERT_LOCATION_TYPES)),
+        ("alerts.diff_alerts[no change]", _sync(diff_alerts, previous, same)),
+        ("alerts.diff_alerts[10% change]", _sync(diff_alerts, previous, actual)),
+        ("alerts.diff_alerts[all start]", _sync(diff_alerts, {}, previous)),
+    ]
+
+
+async def notify_benchmarks(channel_id: int) -> list:
+    main.bot = StubBot()
+    main.outbox = MemoryOutbox()
+    main.delivery = DeliveryEngine(config.DELIVERY_WORKERS, 1e9, 1e9, config.DELIVERY_MAX_RETRIES)
+    main.delivery.start()
+    waves = itertools.count()
+
+    def event(kind, oblast, alert_type="air_raid"):
+        return AlertEvent(kind, f"o-{oblast}", oblast, "oblast", oblast, alert_type)
+
+    wave = [event("start", UKRAINE_REGIONS[0]), event("start", UKRAINE_REGIONS[8], "artillery_shelling"),
+            event("end", UKRAINE_REGIONS[18])]
+    recipients = sum(len(db.subscriptions.subscribers(item.oblast)) for item in wave)
+    channel = db.subscriptions.channels[channel_id]
+
+    async def notify_wave():
+        delivered = await main.notify_about_changes(wave, None, f"bench-{next(waves)}")
+        await delivered
+
+    async def regions_keyboard():
+        await main._get_regions_markup(channel_id)
+
+    return [
+        ("notify.render_change", _sync(main.render_change, channel, wave[0])),
+        ("notify.event_priority", _sync(main.event_priority, wave[1])),
+        (f"notify.notify_about_changes[3 events, {recipients} sends]", notify_wave),
+        ("menu._get_regions_keyboard", regions_keyboard),
+        ("menu._build_regions_markup[uncached]",
+         _sync(main._build_regions_markup.__wrapped__, channel_id, regions_to_mask(UKRAINE_REGIONS[:3]))),
+    ]
+
+
+async def database_benchmarks(channel_id: int, state: dict, outbox_rows: int) -> list:
+    # Outbox заполняем строками нескольких прошедших волн, часть из них уже отправлена
+    now = time.time()
+    keys = [f"old-{index}" for index in range(outbox_rows)]
+    await db.enqueue_outbox([(key, channel_id, "text", None) for key in keys], now - 3600)
+    await db.complete_outbox(keys[:outbox_rows // 2], [])
+    await db.save_alert_state(state)
+    await db.add_admin(config.BOT_OWNER_ID)
+
+    counter = itertools.count()
+    selected = json.dumps(UKRAINE_REGIONS[:3], ensure_ascii=False)
+
+    async def settings_miss():
+        db.settings_cache.invalidate(channel_id)
+        await db.get_channel_settings(channel_id)
+
+    async def enqueue_batch():
+        wave = next(counter)
+        await db.enqueue_outbox([(f"bench-{wave}-{index}", channel_id, "text", None) for index in range(100)], time.time())
+    # Каждый вызов растит таблицу, поэтому число вызовов фиксировано: иначе оно зависело бы от калибровки
+    enqueue_batch.number = 50
+
+    async def complete_batch():
+        start = next(counter) * 100 % (outbox_rows // 2)
+        await db.complete_outbox(keys[outbox_rows // 2 + start:outbox_rows // 2 + start + 50],
+                                 [(1, now, "pending", key) for key in keys[start:start + 50]])
+
+    async def known_channel_cycle():
+        extra_id = -2000000000000 - next(counter) % 1000
+        await db.add_known_channel(extra_id, "Bench")
+        await db.remove_known_channel(extra_id)
+
+    return [
+        ("db.init_db", db.init_db),
+        ("db.load_subscriptions", db.load_subscriptions),
+        ("db.get_channel_settings[hit]", _async(db.get_channel_settings, channel_id)),
+        ("db.get_channel_settings[miss]", settings_miss),
+        ("db.update_channel_message", _async(db.update_channel_message, channel_id, "alert_message", "🚨 {region}")),
+        ("db.add_known_channel", _async(db.add_known_channel, channel_id, "Bench channel")),
+        ("db.add_known_channel+remove_known_channel", known_channel_cycle),
+        ("db.get_all_known_channels", db.get_all_known_channels),
+        ("db.add_or_get_channel[existing]", _async(db.add_or_get_channel, channel_id)),
+        ("db.get_all_channels", db.get_all_channels),
+        ("db.update_channel_regions", _async(db.update_channel_regions, channel_id, selected)),
+        ("db.add_admin", _async(db.add_admin, config.BOT_OWNER_ID)),
+        ("db.is_admin", _async(db.is_admin, config.BOT_OWNER_ID)),
+        ("db.save_alert_state", _async(db.save_alert_state, state)),
+        ("db.touch_alert_state", db.touch_alert_state),
+        ("db.load_alert_state", db.load_alert_state),
+        # Чтение и очистка outbox идут до вставки: она растит таблицу, и их время зависело бы от числа вызовов
+        ("db.get_due_outbox", _async(db.get_due_outbox, now, now, config.OUTBOX_BATCH_SIZE)),
+        ("db.purge_outbox", _async(db.purge_outbox, now - config.OUTBOX_RETENTION)),
+        ("db.complete_outbox[50 sent, 50 failed]", complete_batch),
+        ("db.enqueue_outbox[100 rows]", enqueue_batch),
+    ]
+
+
+async def run_pass(args, rounds: dict, names=None):
+    """Один проход по бенчмаркам (всем или из names) на свежей базе; раунды добавляются в rounds[имя]."""
+    workdir = tempfile.mkdtemp(prefix="borik-micro-")
+    os.chdir(workdir)
+    make_database(os.path.join(workdir, "bot_database.db"), args.channels, seed=args.seed)
+    await db.init_db()
+    rng = random.Random(args.seed)
+    # Канал с подпиской на несколько регионов: для него меню и настройки не тривиальны
+    channel_id = next(channel_id for channel_id, channel in db.subscriptions.channels.items() if channel['regions'] != 'all')
+    state = parse_alerts(alerts_payload(rng), config.ALERT_LOCATION_TYPES)
+
+    benchmarks = await alert_benchmarks(rng)
+    benchmarks += await notify_benchmarks(channel_id)
+    benchmarks += await database_benchmarks(channel_id, state, args.outbox_rows)
+
+    for name, func in benchmarks:
+        if args.filter and args.filter not in name or names is not None and name not in names:
+            continue
+        pass_rounds, number = await measure(func, args.repeat)
+        rounds.setdefault(name, ([], number))[0].extend(pass_rounds)
+
+    await main.delivery.stop()
+    await db.close_db()
+
+
+async def run(args, baseline: dict | None = None) -> dict:
+    # Логи миграций и рассылки мешают читать таблицу результатов
+    logging.getLogger().setLevel(logging.WARNING)
+    rounds = {}
+    for _ in range(args.passes):
+        await run_pass(args, rounds)
+    results = {name: summarize(*name_rounds) for name, name_rounds in rounds.items()}
+
+    # Замедление должно повториться: подозрительные бенчмарки перемеряются, минимум берётся по всем раундам
+    for _ in range(args.confirm if baseline else 0):
+        suspects = set(regressions(results, baseline, args.threshold))
+        if not suspects:
+            break
+        for _ in range(args.passes):
+            await run_pass(args, rounds, suspects)
+        results.update((name, summarize(*rounds[name])) for name in suspects)
+
+    for name, result in results.items():
+        print(f"{name:<55} {result['median_us']:>12.1f} мкс  (мін. {result['min_us']:.1f})")
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "channels": args.channels,
+        "outbox_rows": args.outbox_rows,
+        "results": results,
+    }
+
+
+def regressions(results: dict, baseline: dict, threshold: float) -> list[str]:
+    """Бенчмарки, минимум которых вырос больше чем на threshold (и больше чем на MIN_DIFFERENCE_US)."""
+    slower = []
+    for name, result in results.items():
+        before = baseline["results"].get(name)
+        if before is None or not before["min_us"]:
+            continue
+        if (result["min_us"] / before["min_us"] - 1 > threshold
+                and result["min_us"] - before["min_us"] > MIN_DIFFERENCE_US):
+            slower.append(name)
+    return slower
+
+
+def compare(report: dict, baseline: dict, threshold: float) -> bool:
+    """Печатает изменения относительно базовой линии; True, если есть замедление больше threshold."""
+    slower = set(regressions(report["results"], baseline, threshold))
+    print(f"\nПорівняння з базовою лінією (python {baseline.get('python')}, {baseline.get('channels')} каналів):")
+    for name, result in report["results"].items():
+        before = baseline["results"].get(name)
+        if before is None:
+            print(f"{name:<55} нове")
+            continue
+        # Сравниваем минимумы: медиана функций БД между запусками гуляет на десятки процентов
+        # (кэш страниц SQLite, сборщик мусора, соседние процессы), минимум — на единицы
+        change = result["min_us"] / before["min_us"] - 1 if before["min_us"] else 0.0
+        mark = "  <-- повільніше" if name in slower else ""
+        print(f"{name:<55} {before['min_us']:>12.1f} -> {result['min_us']:>12.1f} мкс  {change:+.0%}{mark}")
+    return bool(slower)
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Мікробенчмарки гарячих функцій бота")
+    parser.add_argument("--channels", type=int, default=10000)
+    parser.add_argument("--outbox-rows", type=int, default=20000)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=5, help="Кількість раундів для кожної функції за один прохід")
+    parser.add_argument("--passes", type=int, default=3, help="Кількість проходів, кожен на свіжій базі")
+    parser.add_argument("--filter", help="Запускати лише бенчмарки, в назві яких є цей рядок")
+    parser.add_argument("--save", nargs="?", const=BASELINE_PATH, help="Зберегти результати як базову лінію")
+    parser.add_argument("--compare", nargs="?", const=BASELINE_PATH, help="Порівняти з базовою лінією")
+    parser.add_argument("--threshold", type=float, default=0.25, help="Допустиме сповільнення при порівнянні")
+    parser.add_argument("--confirm", type=int, default=3,
+                        help="Скільки разів переміряти бенчмарки, що виглядають повільнішими, перш ніж повідомити")
+    args = parser.parse_args()
+    # run() переходит во временный каталог, поэтому пути из аргументов делаем абсолютными
+    args.save = args.save and os.path.abspath(args.save)
+    args.compare = args.compare and os.path.abspath(args.compare)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as file:
+            baseline = json.load(file)
+    report = asyncio.run(run(args, baseline))
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as file:
+            json.dump(report, file, ensure_ascii=False, indent=2)
+    if baseline:
+        if compare(report, baseline, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,48 @@
+# benchmarks/synthetic_db.py
+"""Генерация bot_database.db с большим числом каналов для нагрузочных прогонов."""
+import argparse
+import json
+import random
+import sqlite3
+
+import database as db
+from regions import UKRAINE_REGIONS, REGION_IDS
+
+
+def make_database(path: str, channels: int, all_share: float = 0.3, seed: int = 1) -> str:
+    """Создаёт базу по схеме database.py и заполняет её каналами со случайными подписками."""
+    rng = random.Random(seed)
+    db.DB_PATH = path
+    db._migrate()
+    db._close_connection()
+
+    rows, region_rows = [], []
+    for index in range(channels):
+        channel_id = -1000000000000 - index
+        if rng.random() < all_share:
+            regions = 'all'
+        else:
+            selected_regions = rng.sample(UKRAINE_REGIONS, rng.randint(1, 4))
+            regions = json.dumps(selected_regions, ensure_ascii=False)
+            region_rows.extend((channel_id, REGION_IDS[region]) for region in selected_regions)
+        rows.append((channel_id, regions))
+
+    conn = sqlite3.connect(path)
+    with conn:
+        conn.executemany("INSERT OR REPLACE INTO channels (channel_id, regions) VALUES (?, ?)", rows)
+        conn.executemany("INSERT OR IGNORE INTO channel_regions (channel_id, region_id) VALUES (?, ?)", region_rows)
+        conn.executemany("INSERT OR REPLACE INTO known_channels (channel_id, channel_title) VALUES (?, ?)",
+                         [(channel_id, f"Bench channel {-channel_id}") for channel_id, _ in rows])
+    conn.close()
+    return path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("path")
+    parser.add_argument("--channels", type=int, default=10000)
+    parser.add_argument("--all-share", type=float, default=0.3)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    make_database(args.path, args.channels, args.all_share, args.seed)
+    print(f"Створено {args.path}: {args.channels} каналів")
@@ -0,0 +1,58 @@
+# caches.py
+import time
+
+
+class MemberStatusCache:
+    """TTL-кэш статусов участников каналов: (user_id, channel_id) -> status."""
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._channels = {}   # channel_id -> {user_id: (status, expires_at)}
+
+    def get(self, user_id: int, channel_id: int) -> str | None:
+        entry = self._channels.get(channel_id, {}).get(user_id)
+        if entry is None:
+            return None
+        status, expires_at = entry
+        if expires_at < time.monotonic():
+            self.invalidate(user_id, channel_id)
+            return None
+        return status
+
+    def put(self, user_id: int, channel_id: int, status: str):
+        self._channels.setdefault(channel_id, {})[user_id] = (status, time.monotonic() + self.ttl)
+
+    def invalidate(self, user_id: int, channel_id: int):
+        users = self._channels.get(channel_id)
+        if users:
+            users.pop(user_id, None)
+
+    def invalidate_channel(self, channel_id: int):
+        self._channels.pop(channel_id, None)
+
+
+class ChannelTitleCache:
+    """Названия каналов в памяти. Заполняется из known_channels, устаревшие обновляются в фоне."""
+
+    def __init__(self, max_age: float):
+        self.max_age = max_age
+        self._titles = {}     # channel_id -> (title, время получения)
+
+    def load(self, rows):
+        # Названия из БД могли устареть, поэтому помечаем их как требующие обновления
+        for channel_id, title in rows:
+            self._titles[channel_id] = (title, 0.0)
+
+    def get(self, channel_id: int) -> str | None:
+        entry = self._titles.get(channel_id)
+        return entry[0] if entry else None
+
+    def is_stale(self, channel_id: int) -> bool:
+        entry = self._titles.get(channel_id)
+        return entry is None or time.monotonic() - entry[1] > self.max_age
+
+    def put(self, channel_id: int, title: str):
+        self._titles[channel_id] = (title, time.monotonic())
+
+    def discard(self, channel_id: int):
+        self._titles.pop(channel_id, None)
@@ -12,5 +12,108 @@ API_TOKEN = "bf52a19c09ed2c2abb6a3c884dd4a96c2b3ab08eab2203"
 # ВАЖНО: Указан ваш ID, как вы и просили.
 BOT_OWNER_ID = 6179115044
 
+# URL API активных тревог
+ALERTS_API_URL = "https://api.alerts.in.ua/v1/alerts/active.json"
+
 # URL карты тревог
-ALERTS_MAP_URL = "https://alerts.in.ua/"
\ No newline at end of file
+ALERTS_MAP_URL = "https://alerts.in.ua/"
+
+# Параметры рассылки уведомлений
+# Количество параллельных воркеров отправки
+DELIVERY_WORKERS = 16
+# Глобальный лимит Telegram (сообщений в секунду)
+GLOBAL_RATE_LIMIT = 30
+# Лимит на один чат (сообщений в секунду)
+PER_CHAT_RATE_LIMIT = 1
+# Сколько раз повторять отправку после ответа 429 (TelegramRetryAfter)
+DELIVERY_MAX_RETRIES = 5
+
+# Общий бюджет времени на скриншот карты, включая перезапуск браузера (секунды)
+SCREENSHOT_TIMEOUT = 60
+
+# Чем рисовать карту: "native" — локально из map_regions.json, без браузера;
+# "browser" — скриншот сайта ALERTS_MAP_URL через Playwright
+MAP_RENDERER = "native"
+# Ширина карты в пикселях (высота считается по пропорциям страны)
+MAP_WIDTH = 1000
+
+# Режим доставки уведомлений:
+# "map_first"  — дождаться скриншота карты и отправить его вместе с текстом
+# "text_first" — сразу отправить текст, а карту прислать следом ответом на него
+NOTIFICATION_MODE = "map_first"
+
+# Сколько настроек каналов держать в памяти (LRU-кэш)
+SETTINGS_CACHE_SIZE = 1024
+
+# Сколько готовых клавиатур выбора регионов держать в памяти (ключ — канал и набор регионов)
+REGION_KEYBOARD_CACHE_SIZE = 256
+
+# Дайджест: все изменения одного цикла опроса уходят в канал одним сообщением,
+# а не отдельным сообщением на каждый регион
+DIGEST_MODE = False
+
+# Сохранённое состояние тревог старше этого значения (секунды) считается устаревшим:
+# после запуска по нему не рассылаются отбои, случившиеся за время простоя
+ALERT_STATE_MAX_AGE = 15 * 60
+
+# Интервал опроса API тревог (секунды) и максимальная пауза при ошибках
+POLL_INTERVAL = 15
+POLL_MAX_BACKOFF = 300
+
+# Окно сглаживания (секунды): изменения копятся и рассылаются одним циклом, поэтому отбой,
+# за которым в пределах окна снова пришла тревога, не рассылается вовсе. 0 — рассылать каждый опрос.
+# Новые тревоги и смена типа тревоги по умолчанию окна не ждут и забирают с собой накопленные изменения;
+# ALERT_COALESCE_STARTS = True задерживает и их — тогда короткие тревоги не рассылаются совсем
+ALERT_COALESCE_WINDOW = 60
+ALERT_COALESCE_STARTS = False
+
+# Уровни локаций из API, по которым рассылаются уведомления:
+# "oblast" — области, "city" — города со статусом области (м. Київ), "raion" — районы, "hromada" — громады.
+# Уведомления по районам и громадам получают подписчики соответствующей области
+ALERT_LOCATION_TYPES = ("oblast", "city", "raion", "hromada")
+
+# Внутренний HTTP-сервер бота и эндпоинт метрик Prometheus
+HTTP_HOST = "0.0.0.0"
+HTTP_PORT = 8080
+METRICS_ENABLED = True
+METRICS_PATH = "/metrics"
+# Проверка готовности: 503, пока не завершился первый опрос API тревог после запуска, затем 200
+READINESS_PATH = "/ready"
+
+# Способ получения обновлений от Telegram: "polling" или "webhook".
+# В режиме webhook обновления принимает тот же HTTP-сервер, что и метрики (HTTP_HOST:HTTP_PORT)
+RUN_MODE = "polling"
+# Публичный адрес, по которому Telegram доступен HTTP-сервер бота (без завершающего /)
+WEBHOOK_BASE_URL = "https://example.com"
+WEBHOOK_PATH = "/webhook"
+# Секрет для заголовка X-Telegram-Bot-Api-Secret-Token; пустая строка — случайный при каждом запуске
+WEBHOOK_SECRET = ""
+
+# Проверка прав администратора в /settings: число параллельных запросов get_chat_member
+# и время жизни закэшированного статуса (секунды)
+ADMIN_LOOKUP_CONCURRENCY = 10
+ADMIN_STATUS_CACHE_TTL = 5 * 60
+
+# Через сколько секунд название канала в меню настроек обновляется в фоне через get_chat
+CHANNEL_TITLE_MAX_AGE = 60 * 60
+
+# Число процессов доставки. 0 или 1 — всё в одном процессе.
+# Больше 1 — этот процесс только опрашивает API и обслуживает меню, а рассылку делят между собой
+# отдельные процессы (каждый отвечает за каналы с channel_id % DELIVERY_SHARDS == свой номер).
+# GLOBAL_RATE_LIMIT при этом делится между процессами поровну
+DELIVERY_SHARDS = 0
+# Как часто (секунды) процессы доставки отправляют свои метрики лидеру для /metrics
+SHARD_METRICS_INTERVAL = 5
+
+# Outbox: уведомления сначала пишутся в БД и доставляются хотя бы один раз, в том числе после перезапуска.
+# Неудачная отправка повторяется через OUTBOX_RETRY_BASE * 2^(попытка-1) секунд, но не реже OUTBOX_RETRY_MAX
+OUTBOX_MAX_ATTEMPTS = 8
+OUTBOX_RETRY_BASE = 5
+OUTBOX_RETRY_MAX = 600
+# Как часто фоновый цикл ищет просроченные отправки и сколько берёт за раз
+OUTBOX_POLL_INTERVAL = 5
+OUTBOX_BATCH_SIZE = 500
+# Через сколько секунд неподтверждённая отправка (например, упавшего процесса-шарда) считается потерянной
+OUTBOX_LEASE = 30 * 60
+# Сколько секунд хранить отправленные и окончательно неудачные строки
+OUTBOX_RETENTION = 24 * 60 * 60
@@ -1,11 +1,199 @@
 # database.py
+import asyncio
+import logging
 import sqlite3
 import json
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
-def init_db():
-    conn = sqlite3.connect('bot_database.db')
-    cursor = conn.cursor()
-    cursor.execute('''
+import config
+import metrics
+from regions import UKRAINE_REGIONS, REGION_IDS, regions_to_mask
+
+DB_PATH = 'bot_database.db'
+
+# Одно соединение на весь процесс; все запросы идут через отдельный поток,
+# поэтому обработчики aiogram и опрос API не блокируют друг друга
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite")
+_connection = None
+
+def _get_connection():
+    global _connection
+    if _connection is None:
+        _connection = sqlite3.connect(DB_PATH, check_same_thread=False)
+        _connection.row_factory = sqlite3.Row
+        _connection.execute("PRAGMA journal_mode=WAL")
+        _connection.execute("PRAGMA synchronous=NORMAL")
+        _connection.execute("PRAGMA temp_store=MEMORY")
+        _connection.execute("PRAGMA cache_size=-16000")
+        _connection.execute("PRAGMA busy_timeout=5000")
+    return _connection
+
+def _close_connection():
+    global _connection
+    if _connection is not None:
+        _connection.close()
+        _connection = None
+
+async def _run(func, *args):
+    return await asyncio.get_running_loop().run_in_executor(_executor, func, *args)
+
+def _fetchone(query, params=()):
+    return _get_connection().execute(query, params).fetchone()
+
+def _fetchall(query, params=()):
+    return _get_connection().execute(query, params).fetchall()
+
+def _write(query, params=()):
+    conn = _get_connection()
+    with conn:
+        conn.execute(query, params)
+
+
+class SubscriptionIndex:
+    """Обратный индекс регион → каналы, чтобы рассылка не перебирала всю таблицу channels."""
+
+    def __init__(self):
+        self.channels = {}      # channel_id -> настройки канала (dict)
+        self.by_region = {}     # регион -> множество channel_id
+        self.all_regions = set()
+        self.version = 0        # растёт при каждом изменении, по нему процессы-шарды понимают, что пора перечитать БД
+
+    def load(self, rows, region_rows):
+        """Заполняет индекс строками channels и парами (channel_id, region_id) из channel_regions."""
+        self.channels.clear(); self.by_region.clear(); self.all_regions.clear()
+        self.version += 1
+        for row in rows:
+            self.channels[row['channel_id']] = dict(row)
+            if row['regions'] == 'all':
+                self.all_regions.add(row['channel_id'])
+        for channel_id, region_id in region_rows:
+            if channel_id in self.channels and region_id < len(UKRAINE_REGIONS):
+                self.by_region.setdefault(UKRAINE_REGIONS[region_id], set()).add(channel_id)
+
+    def put(self, row, region_ids=()):
+        """Добавляет или заменяет канал; region_ids — его номера регионов, как в channel_regions."""
+        channel_id = row['channel_id']
+        self.discard(channel_id)
+        self.version += 1
+        self.channels[channel_id] = dict(row)
+        if row['regions'] == 'all':
+            self.all_regions.add(channel_id)
+            return
+        for region_id in region_ids:
+            if region_id < len(UKRAINE_REGIONS):
+                self.by_region.setdefault(UKRAINE_REGIONS[region_id], set()).add(channel_id)
+
+    def discard(self, channel_id):
+        if self.channels.pop(channel_id, None) is None:
+            return
+        self.version += 1
+        self.all_regions.discard(channel_id)
+        for subscribers in self.by_region.values():
+            subscribers.discard(channel_id)
+
+    def subscribers(self, region):
+        """Возвращает настройки всех каналов, которые следят за регионом."""
+        channel_ids = self.all_regions | self.by_region.get(region, set())
+        return [self.channels[channel_id] for channel_id in channel_ids]
+
+
+subscriptions = SubscriptionIndex()
+
+
+def _parse_regions(regions):
+    """Список регионов из channels.regions (JSON-массив названий); для 'all' и битых значений — пустой."""
+    if not regions or regions == 'all':
+        return []
+    try: selected_regions = json.loads(regions)
+    except (json.JSONDecodeError, TypeError): return []
+    return selected_regions if isinstance(selected_regions, list) else []
+
+
+class ChannelSettings:
+    """Настройки канала из таблицы channels. Поддерживает доступ как settings['regions'].
+
+    region_mask — выбранные регионы битами (см. regions.regions_to_mask), None — подписка на всю Украину.
+    """
+
+    COLUMNS = ('channel_id', 'regions', 'alert_message', 'end_alert_message',
+               'artillery_message', 'end_artillery_message')
+    __slots__ = COLUMNS + ('region_mask',)
+
+    def __init__(self, channel_id, regions, alert_message, end_alert_message,
+                 artillery_message, end_artillery_message):
+        self.channel_id = channel_id
+        self.alert_message = alert_message
+        self.end_alert_message = end_alert_message
+        self.artillery_message = artillery_message
+        self.end_artillery_message = end_artillery_message
+        self.set_regions(regions)
+
+    @classmethod
+    def from_row(cls, row):
+        return cls(*(row[name] for name in cls.COLUMNS))
+
+    def set_regions(self, regions):
+        self.regions = regions
+        self.region_mask = None if regions == 'all' else regions_to_mask(_parse_regions(regions))
+
+    def __getitem__(self, key):
+        return getattr(self, key)
+
+
+_MISSING = object()
+
+
+class SettingsCache:
+    """LRU-кэш настроек каналов. Сбрасывается функциями, которые пишут в таблицу channels
+    (выбор регионов обновляется прямо в закэшированных настройках)."""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+
+    def get(self, channel_id):
+        settings = self._items.get(channel_id, _MISSING)
+        if settings is _MISSING:
+            self.misses += 1
+            return _MISSING
+        self.hits += 1
+        self._items.move_to_end(channel_id)
+        return settings
+
+    def put(self, channel_id, settings):
+        self._items[channel_id] = settings
+        self._items.move_to_end(channel_id)
+        if len(self._items) > self.maxsize:
+            self._items.popitem(last=False)
+
+    def peek(self, channel_id):
+        """Настройки из кэша без учёта в статистике и без изменения порядка; None, если их нет."""
+        settings = self._items.get(channel_id)
+        return settings if isinstance(settings, ChannelSettings) else None
+
+    def invalidate(self, channel_id):
+        self._items.pop(channel_id, None)
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._items)}
+
+
+settings_cache = SettingsCache(config.SETTINGS_CACHE_SIZE)
+metrics.Gauge("settings_cache_hits", "Channel settings served from the in-memory cache",
+              lambda: settings_cache.stats()["hits"])
+metrics.Gauge("settings_cache_misses", "Channel settings read from SQLite", lambda: settings_cache.stats()["misses"])
+metrics.Gauge("settings_cache_size", "Channel settings held in the in-memory cache", lambda: settings_cache.stats()["size"])
+
+# --- Миграции схемы ---
+# Номер применённой миграции хранится в PRAGMA user_version. Миграции только добавляются в конец списка.
+
+def _migration_base_tables(conn):
+    # Таблицы, которые раньше создавались при каждом запуске; IF NOT EXISTS — для уже существующих баз
+    conn.execute('''
     CREATE TABLE IF NOT EXISTS channels (
         id INTEGER PRIMARY KEY,
         channel_id INTEGER UNIQUE NOT NULL,
@@ -16,110 +204,234 @@ def init_db():
         end_artillery_message TEXT DEFAULT '✅ Відбій загрози артобстрілу: {region}'
     )
     ''')
-    cursor.execute('''
+    conn.execute('''
     CREATE TABLE IF NOT EXISTS admins (
         id INTEGER PRIMARY KEY,
         user_id INTEGER UNIQUE NOT NULL,
         expiry_date TEXT
     )
     ''')
-    cursor.execute('''
+    conn.execute('''
     CREATE TABLE IF NOT EXISTS known_channels (
         id INTEGER PRIMARY KEY,
         channel_id INTEGER UNIQUE NOT NULL,
         channel_title TEXT
     )
     ''')
-    conn.commit()
-    conn.close()
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS alert_state (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        state TEXT NOT NULL,
+        updated_at REAL NOT NULL
+    )
+    ''')
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS outbox (
+        id INTEGER PRIMARY KEY,
+        idempotency_key TEXT UNIQUE NOT NULL,
+        channel_id INTEGER NOT NULL,
+        message_text TEXT NOT NULL,
+        image_path TEXT,
+        status TEXT NOT NULL DEFAULT 'pending',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        next_attempt_at REAL NOT NULL,
+        created_at REAL NOT NULL
+    )
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox (status, next_attempt_at)")
+
+def _migration_channel_regions(conn):
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS channel_regions (
+        channel_id INTEGER NOT NULL,
+        region_id INTEGER NOT NULL,
+        PRIMARY KEY (channel_id, region_id)
+    ) WITHOUT ROWID
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_channel_regions_region ON channel_regions (region_id, channel_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_channels_all_regions ON channels (channel_id) WHERE regions = 'all'")
+    rows = []
+    for channel_id, regions in conn.execute("SELECT channel_id, regions FROM channels WHERE regions != 'all'"):
+        for region in _parse_regions(regions):
+            if region in REGION_IDS:
+                rows.append((channel_id, REGION_IDS[region]))
+            else:
+                logging.warning(f"Невідомий регіон {region!r} у каналі {channel_id}, пропускаємо")
+    conn.executemany("INSERT OR IGNORE INTO channel_regions (channel_id, region_id) VALUES (?, ?)", rows)
+
+MIGRATIONS = [
+    _migration_base_tables,
+    _migration_channel_regions,
+]
+
+def _migrate():
+    conn = _get_connection()
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+        # Миграция и новый номер версии применяются одной транзакцией
+        conn.execute("BEGIN")
+        with conn:
+            migration(conn)
+            conn.execute(f"PRAGMA user_version = {number}")
+        logging.info(f"Схему бази даних оновлено до версії {number}")
+
+async def init_db():
+    await _run(_migrate)
+    await load_subscriptions()
+
+async def load_subscriptions(channel_filter=None):
+    """Перечитывает индекс подписок из БД; channel_filter(channel_id) оставляет только часть каналов."""
+    rows = await get_all_channels()
+    region_rows = await _run(_fetchall, "SELECT channel_id, region_id FROM channel_regions")
+    if channel_filter is not None:
+        rows = [row for row in rows if channel_filter(row['channel_id'])]
+    subscriptions.load(rows, region_rows)
+
+async def close_db():
+    await _run(_close_connection)
 
 # --- Новые и обновленные функции ---
 
-def get_channel_settings(channel_id):
-    """Возвращает все настройки для конкретного канала."""
-    conn = sqlite3.connect('bot_database.db')
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM channels WHERE channel_id = ?", (channel_id,))
-    settings = cursor.fetchone()
-    conn.close()
+async def get_channel_settings(channel_id):
+    """Возвращает все настройки для конкретного канала (ChannelSettings или None)."""
+    settings = settings_cache.get(channel_id)
+    if settings is _MISSING:
+        row = await _run(_fetchone, "SELECT * FROM channels WHERE channel_id = ?", (channel_id,))
+        settings = ChannelSettings.from_row(row) if row else None
+        settings_cache.put(channel_id, settings)
     return settings
 
-def update_channel_message(channel_id, message_type, text):
+async def update_channel_message(channel_id, message_type, text):
     """Обновляет текст для конкретного типа сообщения."""
-    conn = sqlite3.connect('bot_database.db')
-    cursor = conn.cursor()
     # Безопасно формируем запрос, чтобы избежать SQL-инъекций
     # Убедимся, что message_type - это одно из допустимых полей
     allowed_columns = ['alert_message', 'end_alert_message', 'artillery_message', 'end_artillery_message']
     if message_type not in allowed_columns:
         raise ValueError("Недопустимый тип сообщения")
     
-    cursor.execute(f"UPDATE channels SET {message_type} = ? WHERE channel_id = ?", (text, channel_id))
-    conn.commit()
-    conn.close()
-
-# --- Остальные функции (без изменений) ---
-
-def add_known_channel(channel_id, channel_title):
-    conn = sqlite3.connect('bot_database.db')
-    cursor = conn.cursor()
-    cursor.execute("INSERT OR REPLACE INTO known_channels (channel_id, channel_title) VALUES (?, ?)", (channel_id, channel_title))
-    conn.commit()
-    conn.close()
-
-def remove_known_channel(channel_id):
-    conn = sqlite3.connect('bot_database.db')
-    cursor = conn.cursor()
-    cursor.execute("DELETE FROM known_channels WHERE channel_id = ?", (channel_id,))
-    conn.commit()
-    conn.close()
-
-def get_all_known_channels():
-    conn = sqlite3.connect('bot_database.db')
-    cursor = conn.cursor()
-    cursor.execute("SELECT channel_id, channel_title FROM known_channels")
-    channels = cursor.fetchall()
-    conn.close()
-    return channels
-
-def add_or_get_channel(channel_id):
-    conn = sqlite3.connect('bot_database.db')
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM channels WHERE channel_id = ?", (channel_id,))
-    channel = cursor.fetchone()
+    await _run(_write, f"UPDATE channels SET {message_type} = ? WHERE channel_id = ?", (text, channel_id))
+    settings_cache.invalidate(channel_id)
+    if channel_id in subscriptions.channels:
+        subscriptions.channels[channel_id][message_type] = text
+        subscriptions.version += 1
+
+# --- Остальные функции ---
+
+async def add_known_channel(channel_id, channel_title):
+    await _run(_write, "INSERT OR REPLACE INTO known_channels (channel_id, channel_title) VALUES (?, ?)", (channel_id, channel_title))
+
+async def remove_known_channel(channel_id):
+    await _run(_write, "DELETE FROM known_channels WHERE channel_id = ?", (channel_id,))
+
+async def get_all_known_channels():
+    return await _run(_fetchall, "SELECT channel_id, channel_title FROM known_channels")
+
+def _add_or_get_channel(channel_id):
+    conn = _get_connection()
+    channel = conn.execute("SELECT * FROM channels WHERE channel_id = ?", (channel_id,)).fetchone()
     if not channel:
-        cursor.execute("INSERT INTO channels (channel_id) VALUES (?)", (channel_id,))
-        conn.commit()
-    conn.close()
-
-def get_all_channels():
-    conn = sqlite3.connect('bot_database.db')
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM channels")
-    channels = cursor.fetchall()
-    conn.close()
-    return channels
-
-def update_channel_regions(channel_id, regions_json):
-    conn = sqlite3.connect('bot_database.db')
-    cursor = conn.cursor()
-    cursor.execute("UPDATE channels SET regions = ? WHERE channel_id = ?", (regions_json, channel_id))
-    conn.commit()
-    conn.close()
-
-def add_admin(user_id):
-    conn = sqlite3.connect('bot_database.db')
-    cursor = conn.cursor()
-    cursor.execute("INSERT OR IGNORE INTO admins (user_id) VALUES (?)", (user_id,))
-    conn.commit()
-    conn.close()
-
-def is_admin(user_id):
-    conn = sqlite3.connect('bot_database.db')
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM admins WHERE user_id = ?", (user_id,))
-    admin = cursor.fetchone()
-    conn.close()
-    return admin is not None
\ No newline at end of file
+        with conn:
+            conn.execute("INSERT INTO channels (channel_id) VALUES (?)", (channel_id,))
+        channel = conn.execute("SELECT * FROM channels WHERE channel_id = ?", (channel_id,)).fetchone()
+    region_ids = [row[0] for row in conn.execute("SELECT region_id FROM channel_regions WHERE channel_id = ?", (channel_id,))]
+    return channel, region_ids
+
+async def add_or_get_channel(channel_id):
+    channel, region_ids = await _run(_add_or_get_channel, channel_id)
+    settings_cache.invalidate(channel_id)
+    if channel_id not in subscriptions.channels:
+        subscriptions.put(channel, region_ids)
+    return channel
+
+async def get_all_channels():
+    return await _run(_fetchall, "SELECT * FROM channels")
+
+def _update_channel_regions(channel_id, regions_json):
+    region_ids = [REGION_IDS[region] for region in _parse_regions(regions_json) if region in REGION_IDS]
+    conn = _get_connection()
+    with conn:
+        conn.execute("UPDATE channels SET regions = ? WHERE channel_id = ?", (regions_json, channel_id))
+        conn.execute("DELETE FROM channel_regions WHERE channel_id = ?", (channel_id,))
+        conn.executemany("INSERT INTO channel_regions (channel_id, region_id) VALUES (?, ?)",
+                         [(channel_id, region_id) for region_id in region_ids])
+    return region_ids
+
+async def update_channel_regions(channel_id, regions_json):
+    """Сохраняет выбор регионов: 'all' или JSON-массив названий. Номера регионов пишутся в channel_regions."""
+    region_ids = await _run(_update_channel_regions, channel_id, regions_json)
+    # Кэш обновляем на месте: админ, быстро переключающий регионы, не должен каждый раз ходить в БД
+    settings = settings_cache.peek(channel_id)
+    if settings is not None:
+        settings.set_regions(regions_json)
+    if channel_id in subscriptions.channels:
+        subscriptions.put(dict(subscriptions.channels[channel_id], regions=regions_json), region_ids)
+
+async def add_admin(user_id):
+    await _run(_write, "INSERT OR IGNORE INTO admins (user_id) VALUES (?)", (user_id,))
+
+async def is_admin(user_id):
+    admin = await _run(_fetchone, "SELECT * FROM admins WHERE user_id = ?", (user_id,))
+    return admin is not None
+
+# --- Состояние тревог между перезапусками ---
+
+async def save_alert_state(state):
+    """Сохраняет состояние и возвращает время сохранения."""
+    saved_at = time.time()
+    await _run(_write, "INSERT OR REPLACE INTO alert_state (id, state, updated_at) VALUES (1, ?, ?)",
+               (json.dumps(state, ensure_ascii=False), saved_at))
+    return saved_at
+
+async def touch_alert_state():
+    """Отмечает, что сохранённое состояние всё ещё актуально (ответ API не изменился), и возвращает новое время."""
+    saved_at = time.time()
+    await _run(_write, "UPDATE alert_state SET updated_at = ? WHERE id = 1", (saved_at,))
+    return saved_at
+
+async def load_alert_state():
+    """Возвращает (состояние, время сохранения) или (None, None), если снимка нет."""
+    row = await _run(_fetchone, "SELECT state, updated_at FROM alert_state WHERE id = 1")
+    if row is None:
+        return None, None
+    try:
+        return json.loads(row['state']), row['updated_at']
+    except (json.JSONDecodeError, TypeError):
+        return None, None
+
+# --- Outbox: уведомления, которые ещё нужно доставить ---
+
+def _enqueue_outbox(rows, now):
+    conn = _get_connection()
+    inserted = []
+    with conn:
+        for key, channel_id, message_text, image_path in rows:
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO outbox (idempotency_key, channel_id, message_text, image_path, next_attempt_at, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)", (key, channel_id, message_text, image_path, now, now))
+            if cursor.rowcount:
+                inserted.append((key, channel_id, message_text, image_path))
+    return inserted
+
+async def enqueue_outbox(rows, now):
+    """Добавляет строки (ключ, channel_id, текст, картинка) одной транзакцией и возвращает только новые."""
+    return await _run(_enqueue_outbox, rows, now)
+
+def _complete_outbox(sent_keys, failed):
+    conn = _get_connection()
+    with conn:
+        conn.executemany("UPDATE outbox SET status = 'sent' WHERE idempotency_key = ?", ((key,) for key in sent_keys))
+        conn.executemany("UPDATE outbox SET attempts = ?, next_attempt_at = ?, status = ? WHERE idempotency_key = ?", failed)
+
+async def complete_outbox(sent_keys, failed):
+    """Отмечает отправленные ключи и переносит неудачные: failed — (попытки, время повтора, статус, ключ)."""
+    await _run(_complete_outbox, sent_keys, failed)
+
+async def get_due_outbox(now, created_before, limit):
+    """Строки, которые пора повторить: после неудачной попытки или оставшиеся от прошлого запуска."""
+    return await _run(_fetchall,
+                      "SELECT idempotency_key, channel_id, message_text, image_path, attempts FROM outbox "
+                      "WHERE status = 'pending' AND next_attempt_at <= ? AND (attempts > 0 OR created_at < ?) "
+                      "ORDER BY next_attempt_at LIMIT ?", (now, created_before, limit))
+
+async def purge_outbox(older_than):
+    await _run(_write, "DELETE FROM outbox WHERE status != 'pending' AND created_at < ?", (older_than,))
@@ -0,0 +1,207 @@
+# delivery.py
+import asyncio
+import logging
+import time
+from collections import OrderedDict, deque
+from typing import Any, Awaitable, Callable
+
+from aiogram.exceptions import TelegramAPIError, TelegramRetryAfter
+
+import config
+import metrics
+
+# Лимиты Telegram на длину подписи к фото и текста сообщения
+CAPTION_LIMIT = 1024
+MESSAGE_LIMIT = 4096
+
+# Приоритеты очереди доставки: меньше — раньше
+PRIORITY_AIR_RAID = 0       # начало воздушной тревоги
+PRIORITY_START = 1          # начало тревоги другого типа (артобстрел и т.д.)
+PRIORITY_END = 2            # отбои
+PRIORITY_BACKGROUND = 3     # карты вдогонку и повторы из outbox
+
+
+def split_message(lines: list[str], first_limit: int, limit: int) -> list[str]:
+    """Склеивает строки в сообщения, не превышая лимит длины (первое сообщение — first_limit)."""
+    parts, current = [], ""
+    current_limit = first_limit
+    for line in lines:
+        candidate = f"{current}\n{line}" if current else line
+        if len(candidate) <= current_limit:
+            current = candidate
+            continue
+        if current:
+            parts.append(current)
+            current_limit = limit
+        # Строка, которая сама длиннее лимита, режется на куски
+        while len(line) > current_limit:
+            parts.append(line[:current_limit])
+            line = line[current_limit:]
+            current_limit = limit
+        current = line
+    if current:
+        parts.append(current)
+    return parts
+
+class TokenBucket:
+    """Токен-бакет: не более rate операций в секунду, с запасом до capacity."""
+
+    def __init__(self, rate: float, capacity: float | None = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def block(self, seconds: float):
+        """Запрещает выдачу токенов на указанное время (например, после 429)."""
+        self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._blocked_until:
+                    await asyncio.sleep(self._blocked_until - now)
+                    continue
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class DeliveryEngine:
+    """Пул воркеров для рассылки с глобальным и поканальным ограничением скорости.
+
+    Очередь приоритетная: у каждого чата своя FIFO-очередь, а воркеры выбирают чат с самым срочным
+    ожидающим сообщением, по кругу среди чатов одного приоритета. Сообщения одного чата уходят
+    по порядку и не параллельно, поэтому отбой никогда не обгонит начало той же тревоги.
+    """
+
+    def __init__(self, workers: int, global_rate: float, per_chat_rate: float, max_retries: int):
+        self.workers_count = workers
+        self.per_chat_rate = per_chat_rate
+        self.max_retries = max_retries
+        self._global_bucket = TokenBucket(global_rate)
+        self._chat_buckets: dict[int, TokenBucket] = {}
+        self._chats: dict[int, deque] = {}          # chat_id -> очередь (send, future, attempt, priority)
+        self._levels = [OrderedDict() for _ in range(PRIORITY_BACKGROUND + 1)]  # готовые к отправке чаты по приоритетам
+        self._chat_level: dict[int, int] = {}       # в каком из _levels сейчас стоит чат
+        self._busy: set[int] = set()                # чаты, из которых сейчас идёт отправка
+        self._pending = 0
+        self._wakeup = asyncio.Event()
+        self._workers: list[asyncio.Task] = []
+
+    def start(self):
+        if self._workers:
+            return
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.workers_count)]
+
+    async def stop(self):
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    @property
+    def queue_depth(self) -> int:
+        return self._pending
+
+    def submit(self, chat_id: int, send: Callable[[], Awaitable[Any]], priority: int = PRIORITY_BACKGROUND) -> asyncio.Future:
+        """Ставит отправку в очередь. Future получает результат send() или None при неудаче."""
+        future = asyncio.get_running_loop().create_future()
+        self._chats.setdefault(chat_id, deque()).append((send, future, 0, priority))
+        self._pending += 1
+        self._schedule(chat_id, priority)
+        return future
+
+    def _schedule(self, chat_id: int, priority: int):
+        """Ставит чат в круг готовых на уровень priority (или выше, если он там уже стоит)."""
+        if chat_id in self._busy:
+            return
+        level = self._chat_level.get(chat_id)
+        if level is not None:
+            if level <= priority:
+                return
+            # Срочное сообщение поднимает весь чат: ждущие перед ним сообщения уходят вместе с ним
+            del self._levels[level][chat_id]
+        self._levels[priority][chat_id] = None
+        self._chat_level[chat_id] = priority
+        self._wakeup.set()
+
+    def _release(self, chat_id: int):
+        self._busy.discard(chat_id)
+        items = self._chats.get(chat_id)
+        if not items:
+            self._chats.pop(chat_id, None)
+            return
+        self._schedule(chat_id, min(item[3] for item in items))
+
+    async def _next_chat(self) -> int:
+        while True:
+            for ring in self._levels:
+                if ring:
+                    chat_id, _ = ring.popitem(last=False)
+                    del self._chat_level[chat_id]
+                    self._busy.add(chat_id)
+                    return chat_id
+            self._wakeup.clear()
+            await self._wakeup.wait()
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._chat_buckets[chat_id] = TokenBucket(self.per_chat_rate, 1)
+        return bucket
+
+    async def _worker(self):
+        while True:
+            chat_id = await self._next_chat()
+            send, future, attempt, priority = self._chats[chat_id].popleft()
+            self._pending -= 1
+            started = None
+            try:
+                await self._chat_bucket(chat_id).acquire()
+                await self._global_bucket.acquire()
+                started = time.perf_counter()
+                result = await send()
+                metrics.send_seconds.observe(time.perf_counter() - started, result="ok")
+            except TelegramRetryAfter as e:
+                metrics.retry_after_total.inc()
+                metrics.send_seconds.observe(time.perf_counter() - started, result="retry_after")
+                if attempt < self.max_retries:
+                    logging.warning(f"Ліміт Telegram для {chat_id}, повтор через {e.retry_after} с")
+                    self._chat_bucket(chat_id).block(e.retry_after)
+                    # Повтор встаёт в начало очереди чата, чтобы не нарушить порядок сообщений
+                    self._chats[chat_id].appendleft((send, future, attempt + 1, priority))
+                    self._pending += 1
+                elif not future.done():
+                    logging.error(f"Не вдалося надіслати в {chat_id}: вичерпано спроби після 429")
+                    future.set_result(None)
+            except TelegramAPIError as e:
+                if started is not None:
+                    metrics.send_seconds.observe(time.perf_counter() - started, result="error")
+                logging.warning(f"Помилка відправки в {chat_id}: {e}")
+                if not future.done():
+                    future.set_result(None)
+            except Exception as e:
+                logging.error(f"Непередбачена помилка відправки в {chat_id}: {e}")
+                if not future.done():
+                    future.set_result(None)
+            else:
+                if not future.done():
+                    future.set_result(result)
+            finally:
+                self._release(chat_id)
+
+
+delivery = DeliveryEngine(
+    workers=config.DELIVERY_WORKERS,
+    global_rate=config.GLOBAL_RATE_LIMIT,
+    per_chat_rate=config.PER_CHAT_RATE_LIMIT,
+    max_retries=config.DELIVERY_MAX_RETRIES,
+)
+metrics.Gauge("delivery_queue_depth", "Sends waiting in the delivery queue", lambda: delivery.queue_depth, aggregate=True)
@@ -4,22 +4,39 @@ import json
 import logging
 import traceback
 import os
+import secrets
+import time
+# Отметка для замера холодного старта ставится до импорта aiogram и остальных тяжёлых модулей
+STARTUP_STARTED = time.monotonic()
 from contextlib import suppress
-from playwright.async_api import async_playwright
+from functools import lru_cache, partial
 
-from aiogram.exceptions import TelegramAPIError
+from aiogram.exceptions import TelegramAPIError, TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import StatesGroup, State
 
 import aiohttp
+from aiohttp import web
 from aiogram import Bot, Dispatcher, types, F
 from aiogram.client.default import DefaultBotProperties
 from aiogram.filters import Command, CommandStart
-from aiogram.types import Message, CallbackQuery, ChatMemberUpdated, FSInputFile
+from aiogram.types import Message, CallbackQuery, ChatMemberUpdated, InlineKeyboardMarkup
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 
 import config
 import database as db
+from caches import ChannelTitleCache, MemberStatusCache
+import metrics
+from delivery import (delivery, split_message, CAPTION_LIMIT, MESSAGE_LIMIT,
+                      PRIORITY_AIR_RAID, PRIORITY_START, PRIORITY_END, PRIORITY_BACKGROUND)
+from media import media_cache
+from poller import AlertsPoller, AlertsAPIError
+from alert_events import AlertEvent, ChangeCoalescer, diff_alerts, parse_alerts, restore_state, wave_key
+from outbox import outbox
+from screenshot import map_screenshotter, take_alert_map_screenshot
+from map_renderer import map_renderer
+from sharding import ShardPool
+from regions import UKRAINE_REGIONS, mask_to_regions
 
 # --- Настройка и инициализация ---
 logging.basicConfig(level=logging.INFO)
@@ -28,15 +45,16 @@ dp = Dispatcher()
 
 # --- Глобальные переменные и константы ---
 current_alerts_state = {}
-UKRAINE_REGIONS = [
-    "Вінницька область", "Волинська область", "Дніпропетровська область", "Донецька область",
-    "Житомирська область", "Закарпатська область", "Запорізька область", "Івано-Франківська область",
-    "Київська область", "Кіровоградська область", "Луганська область", "Львівська область",
-    "Миколаївська область", "Одеська область", "Полтавська область", "Рівненська область",
-    "Сумська область", "Тернопільська область", "Харківська область", "Херсонська область",
-    "Хмельницька область", "Черкаська область", "Чернівецька область", "Чернігівська область",
-    "м. Київ", "Автономна Республіка Крим"
-]
+alert_state_saved_at = None
+shard_pool: ShardPool | None = None
+member_status_cache = MemberStatusCache(config.ADMIN_STATUS_CACHE_TTL)
+channel_titles = ChannelTitleCache(config.CHANNEL_TITLE_MAX_AGE)
+_title_refreshes = set()
+# Выставляется после первого успешного опроса API: с этого момента бот снова следит за тревогами
+ready = asyncio.Event()
+cold_start_seconds = None
+
+MAP_LINK = f"\n\n<a href='{config.ALERTS_MAP_URL}'>Мапа тривог</a>"
 
 MESSAGE_TYPES = {
     "alert_message": "🚨 Повідомлення про тривогу",
@@ -49,24 +67,6 @@ MESSAGE_TYPES = {
 class MessageSettings(StatesGroup):
     waiting_for_template = State()
 
-# --- Функция создания скриншота ---
-async def take_alert_map_screenshot() -> str | None:
-    try:
-        async with async_playwright() as p:
-            browser = await p.chromium.launch(headless=True)
-            page = await browser.new_page()
-            await page.set_viewport_size({"width": 1280, "height": 900})
-            await page.goto(config.ALERTS_MAP_URL, timeout=60000, wait_until="networkidle")
-            
-            screenshot_path = "alerts_map.png"
-            await page.locator("#map").screenshot(path=screenshot_path)
-            await browser.close()
-            logging.info(f"Скріншот карти збережено: {screenshot_path}")
-            return screenshot_path
-    except Exception as e:
-        logging.error(f"Помилка при створенні скріншоту: {e}")
-        return None
-
 # --- Вспомогательные функции для создания меню ---
 
 async def _get_main_settings_keyboard(channel_id: int) -> InlineKeyboardBuilder:
@@ -76,12 +76,28 @@ async def _get_main_settings_keyboard(channel_id: int) -> InlineKeyboardBuilder:
     builder.adjust(1)
     return builder
 
-async def show_main_settings_menu(message: Message, channel_id: int):
+def schedule_title_refresh(channel_id: int):
+    if channel_id in _title_refreshes:
+        return
+    _title_refreshes.add(channel_id)
+    asyncio.create_task(_refresh_channel_title(channel_id))
+
+async def _refresh_channel_title(channel_id: int):
     try:
-        channel = await bot.get_chat(channel_id)
-        title = channel.title
+        chat = await bot.get_chat(channel_id)
+        if chat.title != channel_titles.get(channel_id):
+            await db.add_known_channel(channel_id, chat.title)
+        channel_titles.put(channel_id, chat.title)
     except TelegramAPIError:
-        title = f"ID: {channel_id}" # Fallback if bot is not admin in the chat anymore
+        pass  # Бот больше не админ в канале — оставляем прежнее название
+    finally:
+        _title_refreshes.discard(channel_id)
+
+async def show_main_settings_menu(message: Message, channel_id: int):
+    # Название берём из памяти; устаревшее обновится в фоне к следующему показу меню
+    if channel_titles.is_stale(channel_id):
+        schedule_title_refresh(channel_id)
+    title = channel_titles.get(channel_id) or f"ID: {channel_id}"
         
     builder = await _get_main_settings_keyboard(channel_id)
     with suppress(TelegramAPIError):
@@ -90,27 +106,27 @@ async def show_main_settings_menu(message: Message, channel_id: int):
             reply_markup=builder.as_markup()
         )
 
-async def _get_regions_keyboard(channel_id: int) -> InlineKeyboardBuilder:
-    settings = db.get_channel_settings(channel_id)
-    selected_regions, is_all_ukraine = [], settings and settings['regions'] == 'all'
-    if not is_all_ukraine and settings and settings['regions']:
-        try: selected_regions = json.loads(settings['regions'])
-        except (json.JSONDecodeError, TypeError): selected_regions = []
-
+@lru_cache(maxsize=config.REGION_KEYBOARD_CACHE_SIZE)
+def _build_regions_markup(channel_id: int, region_mask: int | None) -> InlineKeyboardMarkup:
+    """Клавиатура выбора регионов; region_mask — биты выбранных регионов, None — вся Украина."""
     builder = InlineKeyboardBuilder()
-    builder.button(text=f"{'✅ ' if is_all_ukraine else ''}Вся Україна", callback_data=f"sr_{channel_id}_all")
+    builder.button(text=f"{'✅ ' if region_mask is None else ''}Вся Україна", callback_data=f"sr_{channel_id}_all")
     
     # ИЗМЕНЕНИЕ: Используем индекс вместо названия для callback_data
     for index, region in enumerate(UKRAINE_REGIONS):
-        text = f"{'✅ ' if region in selected_regions else ''}{region}"
-        builder.button(text=text, callback_data=f"sr_{channel_id}_{index}")
+        is_selected = region_mask is not None and region_mask >> index & 1
+        builder.button(text=f"{'✅ ' if is_selected else ''}{region}", callback_data=f"sr_{channel_id}_{index}")
     
     builder.button(text="⬅️ Назад", callback_data=f"back_to_main_settings_{channel_id}")
     builder.adjust(1, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 1)
-    return builder
+    return builder.as_markup()
+
+async def _get_regions_markup(channel_id: int) -> InlineKeyboardMarkup:
+    settings = await db.get_channel_settings(channel_id)
+    return _build_regions_markup(channel_id, settings.region_mask if settings else 0)
 
 async def show_message_settings_menu(message: Message, channel_id: int):
-    settings = db.get_channel_settings(channel_id)
+    settings = await db.get_channel_settings(channel_id)
     text = "📝 <b>Налаштування шаблонів повідомлень.</b>\n\nОберіть, який шаблон ви хочете змінити. Поточні значення:\n\n"
     for key, value in MESSAGE_TYPES.items():
         text += f"{value}:\n<code>{settings[key]}</code>\n\n"
@@ -124,21 +140,50 @@ async def show_message_settings_menu(message: Message, channel_id: int):
     with suppress(TelegramAPIError):
         await message.edit_text(text, reply_markup=builder.as_markup())
 
+async def get_member_status(channel_id: int, user_id: int, semaphore: asyncio.Semaphore) -> str:
+    status = member_status_cache.get(user_id, channel_id)
+    if status is not None:
+        return status
+    for attempt in range(config.DELIVERY_MAX_RETRIES + 1):
+        async with semaphore:
+            try:
+                status = (await bot.get_chat_member(channel_id, user_id)).status
+            except (TelegramBadRequest, TelegramForbiddenError):
+                status = ""  # Бот больше не видит канал — тоже кэшируем, чтобы не спрашивать снова
+            except TelegramRetryAfter as e:
+                retry_after = e.retry_after
+            except TelegramAPIError as e:
+                # Сетевые и прочие временные ошибки не кэшируем: канал не должен пропасть из списка надолго
+                logging.warning(f"Не вдалося перевірити статус у каналі {channel_id}: {e}")
+                return ""
+        if status is not None:
+            member_status_cache.put(user_id, channel_id, status)
+            return status
+        await asyncio.sleep(retry_after)
+    return ""
+
 # --- Основные обработчики команд и событий ---
 
 @dp.my_chat_member()
 async def on_bot_join_or_leave(update: ChatMemberUpdated):
+    member_status_cache.invalidate_channel(update.chat.id)
     if update.new_chat_member.status in ["member", "administrator"]:
-        db.add_known_channel(update.chat.id, update.chat.title)
+        await db.add_known_channel(update.chat.id, update.chat.title)
+        channel_titles.put(update.chat.id, update.chat.title)
     elif update.new_chat_member.status in ["left", "kicked"]:
-        db.remove_known_channel(update.chat.id)
+        await db.remove_known_channel(update.chat.id)
+        channel_titles.discard(update.chat.id)
+
+@dp.chat_member()
+async def on_chat_member_update(update: ChatMemberUpdated):
+    member_status_cache.put(update.new_chat_member.user.id, update.chat.id, update.new_chat_member.status)
 
 @dp.message(Command("add_admin"))
 async def add_admin_command(message: Message):
     if message.from_user.id != config.BOT_OWNER_ID: return
     try:
         user_id = int(message.text.split()[1])
-        db.add_admin(user_id)
+        await db.add_admin(user_id)
         await message.answer(f"✅ Користувача <code>{user_id}</code> додано до списку адміністраторів.")
     except (IndexError, ValueError):
         await message.answer("Будь ласка, вкажіть ID користувача. Приклад: <code>/add_admin 123456</code>")
@@ -153,15 +198,18 @@ async def settings_command(message: Message, state: FSMContext):
     await state.clear()
     if message.chat.type != 'private':
         return await message.answer("Будь ласка, налаштовуйте бота в особистих повідомленнях.")
-    if not db.is_admin(message.from_user.id):
+    if not await db.is_admin(message.from_user.id):
         return await message.answer("❌ У вас немає прав налаштовувати цього бота. Зверніться до власника.")
 
-    known_channels, admin_channels = db.get_all_known_channels(), []
-    for channel_id, channel_title in known_channels:
-        with suppress(TelegramAPIError):
-            member = await bot.get_chat_member(channel_id, message.from_user.id)
-            if member.status in ['creator', 'administrator']:
-                admin_channels.append((channel_id, channel_title))
+    known_channels = await db.get_all_known_channels()
+    semaphore = asyncio.Semaphore(config.ADMIN_LOOKUP_CONCURRENCY)
+    statuses = await asyncio.gather(*(
+        get_member_status(channel_id, message.from_user.id, semaphore) for channel_id, _ in known_channels
+    ))
+    admin_channels = [
+        (channel_id, channel_title) for (channel_id, channel_title), status in zip(known_channels, statuses)
+        if status in ['creator', 'administrator']
+    ]
 
     if not admin_channels:
         return await message.answer("Я не знайшов каналів, де ви є адміністратором і куди я теж доданий.")
@@ -178,7 +226,7 @@ async def settings_command(message: Message, state: FSMContext):
 @dp.callback_query(F.data.startswith("select_ch_"))
 async def callback_select_channel(callback: CallbackQuery):
     channel_id = int(callback.data.split("_")[2])
-    db.add_or_get_channel(channel_id)
+    await db.add_or_get_channel(channel_id)
     await show_main_settings_menu(callback.message, channel_id)
     await callback.answer()
 
@@ -191,8 +239,8 @@ async def callback_back_to_main_settings(callback: CallbackQuery):
 @dp.callback_query(F.data.startswith("cfg_regions_"))
 async def callback_configure_regions(callback: CallbackQuery):
     channel_id = int(callback.data.split("_")[2])
-    builder = await _get_regions_keyboard(channel_id)
-    await callback.message.edit_text("🏙️ Оберіть регіони для відстежування:", reply_markup=builder.as_markup())
+    await callback.message.edit_text("🏙️ Оберіть регіони для відстежування:",
+                                      reply_markup=await _get_regions_markup(channel_id))
     await callback.answer()
 
 # НОВЫЙ ОБРАБОТЧИК для кнопок с индексом региона
@@ -203,32 +251,29 @@ async def callback_set_region_by_index(callback: CallbackQuery):
     parts = callback.data.split("_"); channel_id = int(parts[1])
     region_identifier = parts[2]
     
-    settings = db.get_channel_settings(channel_id); is_all_ukraine = settings and settings['regions'] == 'all'
-    selected_regions = []
-    if not is_all_ukraine and settings and settings['regions']:
-        try: selected_regions = json.loads(settings['regions'])
-        except (json.JSONDecodeError, TypeError): selected_regions = []
+    # Настройки берутся из кэша, поэтому переключение — это один XOR и одна запись в БД
+    settings = await db.get_channel_settings(channel_id)
+    region_mask = settings.region_mask if settings else 0
 
     if region_identifier == "all":
-        db.update_channel_regions(channel_id, 'all')
+        await db.update_channel_regions(channel_id, 'all')
     else:
         try:
             region_index = int(region_identifier)
-            region_name = UKRAINE_REGIONS[region_index]
+            if not 0 <= region_index < len(UKRAINE_REGIONS):
+                raise IndexError(region_index)
             
-            if is_all_ukraine:
-                selected_regions = [region_name]
+            if region_mask is None:
+                region_mask = 1 << region_index
             else:
-                if region_name in selected_regions: selected_regions.remove(region_name)
-                else: selected_regions.append(region_name)
-            db.update_channel_regions(channel_id, json.dumps(selected_regions))
+                region_mask ^= 1 << region_index
+            await db.update_channel_regions(channel_id, json.dumps(mask_to_regions(region_mask)))
         except (ValueError, IndexError):
             logging.error(f"Некоректний індекс регіону в callback: {callback.data}")
             return
     
-    builder = await _get_regions_keyboard(channel_id)
     with suppress(TelegramAPIError):
-        await callback.message.edit_reply_markup(reply_markup=builder.as_markup())
+        await callback.message.edit_reply_markup(reply_markup=await _get_regions_markup(channel_id))
 
 
 @dp.callback_query(F.data.startswith("cfg_msg_menu_"))
@@ -240,7 +285,7 @@ async def callback_msg_menu(callback: CallbackQuery):
 @dp.callback_query(F.data.startswith("set_msg_"))
 async def callback_set_msg_template(callback: CallbackQuery, state: FSMContext):
     parts = callback.data.split("_"); channel_id = int(parts[2]); message_type = parts[3]
-    settings = db.get_channel_settings(channel_id)
+    settings = await db.get_channel_settings(channel_id)
     
     await state.set_state(MessageSettings.waiting_for_template)
     await state.update_data(channel_id=channel_id, message_type=message_type)
@@ -260,7 +305,7 @@ async def process_new_template(message: Message, state: FSMContext):
         return await message.answer("❌ **Помилка:** ваш текст не містить змінну <code>{region}</code>. Спробуйте ще раз.")
 
     data = await state.get_data(); channel_id = data['channel_id']; message_type = data['message_type']
-    db.update_channel_message(channel_id, message_type, message.text)
+    await db.update_channel_message(channel_id, message_type, message.text)
     await state.clear()
     await message.answer("✅ Налаштування збережено!")
     await show_message_settings_menu(message, channel_id)
@@ -274,71 +319,320 @@ async def cancel_fsm(callback: CallbackQuery, state: FSMContext):
 
 # --- Фоновая задача мониторинга и отправки уведомлений ---
 
-async def check_alerts():
-    global current_alerts_state
+async def restore_alerts_state() -> str:
+    """Восстанавливает состояние тревог из БД и возвращает режим сверки для первого опроса."""
+    global current_alerts_state, alert_state_saved_at
+    snapshot, saved_at = await db.load_alert_state()
+    state = restore_state(snapshot)
+    if state is None:
+        logging.info("Збереженого стану тривог немає, перше опитування стане базовим")
+        return "baseline"
+    current_alerts_state = state
+    alert_state_saved_at = saved_at
+    age = time.time() - saved_at
+    if age > config.ALERT_STATE_MAX_AGE:
+        logging.warning(f"Збережений стан тривог застарів ({age:.0f} с), відбої за час простою не надсилаються")
+        return "stale"
+    logging.info(f"Відновлено стан тривог: {len(state)} локацій, збережено {age:.0f} с тому")
+    return "fresh"
+
+async def check_alerts(reconcile: str = "fresh"):
+    global current_alerts_state, alert_state_saved_at
     headers = {"Authorization": f"Bearer {config.API_TOKEN}"}
-    api_url = "https://api.alerts.in.ua/v1/alerts/active.json"
     
+    # В БД сохраняется состояние, о котором уже знают подписчики, а не последний ответ API:
+    # изменения, ждущие окна сглаживания, после перезапуска будут разосланы заново
+    coalescer = ChangeCoalescer(config.ALERT_COALESCE_WINDOW, config.ALERT_COALESCE_STARTS,
+                                lambda kind, count: metrics.alert_events_suppressed_total.inc(count, kind=kind))
+    coalescer.reset(current_alerts_state)
     async with aiohttp.ClientSession(headers=headers) as session:
+        poller = AlertsPoller(session, config.ALERTS_API_URL, config.POLL_INTERVAL, config.POLL_MAX_BACKOFF)
         while True:
-            await asyncio.sleep(30)
+            failed = False
             try:
-                async with session.get(api_url) as response:
-                    if response.status != 200:
-                        logging.error(f"Помилка API: {response.status}"); continue
-                    data = await response.json()
-                    actual_alerts = {a['location_title']: a['alert_type'] for a in data.get("alerts", [])}
-                    new_alerts = {r: t for r, t in actual_alerts.items() if r not in current_alerts_state}
-                    ended_alerts = {r: t for r, t in current_alerts_state.items() if r not in actual_alerts}
-
-                    if new_alerts or ended_alerts:
-                        screenshot_path = await take_alert_map_screenshot()
-                        if new_alerts:
-                            logging.info(f"Нові тривоги: {list(new_alerts.keys())}")
-                            await notify_about_changes(new_alerts, "start", screenshot_path)
-                        if ended_alerts:
-                            logging.info(f"Відбої тривог: {list(ended_alerts.keys())}")
-                            await notify_about_changes(ended_alerts, "end", screenshot_path)
-                        if screenshot_path and os.path.exists(screenshot_path):
-                            os.remove(screenshot_path)
-
-                    current_alerts_state = actual_alerts
+                data = await poller.fetch()
+                if data is None:
+                    events = coalescer.flush_due(time.monotonic())
+                else:
+                    actual_alerts = parse_alerts(data, config.ALERT_LOCATION_TYPES)
+                    if reconcile == "fresh":
+                        events = coalescer.update(actual_alerts, time.monotonic())
+                    else:
+                        # Первый опрос после запуска сверяется с восстановленным состоянием без окна
+                        events = [] if reconcile == "baseline" else [
+                            event for event in diff_alerts(current_alerts_state, actual_alerts) if event.kind != "end"]
+                        coalescer.reset(actual_alerts)
+                        reconcile = "fresh"
+
+                if events:
+                    try:
+                        await dispatch_changes(events, wave_key(alert_state_saved_at, coalescer.announced), coalescer.announced)
+                    except Exception:
+                        # Волна не ушла: следующий опрос снова увидит эти изменения
+                        coalescer.announced = current_alerts_state
+                        raise
+                if coalescer.announced is not current_alerts_state:
+                    current_alerts_state = coalescer.announced
+                    alert_state_saved_at = await db.save_alert_state(current_alerts_state)
+                else:
+                    alert_state_saved_at = await db.touch_alert_state()
+                if data is not None:
+                    poller.mark_processed()
+                mark_ready()
+            except AlertsAPIError as e:
+                failed = True
+                logging.error(f"Помилка API: {e.status}")
             except Exception as e:
+                failed = True
                 logging.error(f"Помилка в фоновій задачі: {e}")
-
-async def notify_about_changes(changes: dict, change_type: str, image_path: str | None):
-    all_channels = db.get_all_channels()
-    for channel in all_channels:
-        channel_id, regions_to_track = channel['channel_id'], channel['regions']
-        for region, alert_type in changes.items():
-            if regions_to_track != 'all':
-                try:
-                    if region not in json.loads(regions_to_track): continue
-                except (json.JSONDecodeError, TypeError): continue
-            
-            if change_type == "start":
-                msg_template = channel['alert_message' if alert_type == "air_raid" else 'artillery_message']
-            else:
-                original_alert_type = current_alerts_state.get(region, "air_raid")
-                msg_template = channel['end_alert_message' if original_alert_type == "air_raid" else 'end_artillery_message']
-            
-            message_text = msg_template.format(region=region)
-            
-            with suppress(TelegramAPIError):
-                if image_path:
-                    await bot.send_photo(channel_id, FSInputFile(path=image_path), caption=message_text)
-                else:
-                    text_with_link = message_text + f"\n\n<a href='{config.ALERTS_MAP_URL}'>Мапа тривог</a>"
-                    await bot.send_message(channel_id, text_with_link, disable_web_page_preview=True)
-
-# --- Основная функция запуска ---
+            await asyncio.sleep(poller.next_delay(failed))
+
+def mark_ready():
+    global cold_start_seconds
+    if ready.is_set():
+        return
+    cold_start_seconds = time.monotonic() - STARTUP_STARTED
+    ready.set()
+    logging.info(f"Бот готовий: перше опитування завершено через {cold_start_seconds:.2f} с після запуску")
+
+metrics.Gauge("bot_cold_start_seconds", "Time from process start to the first completed alerts poll",
+              lambda: cold_start_seconds if cold_start_seconds is not None else float("nan"))
+
+async def dispatch_changes(events: list[AlertEvent], wave: str, alerts_state: dict):
+    """Ставит волну в очередь доставки и возвращается, не дожидаясь окончания рассылки.
+
+    Следующий опрос не ждёт, пока уйдут тысячи отбоев: его новые тревоги обгонят их в приоритетной очереди.
+    """
+    detected_at = time.monotonic()
+    for kind, label in (("start", "Нові тривоги"), ("type_change", "Зміна типу тривоги"), ("end", "Відбої тривог")):
+        titles = [event.region for event in events if event.kind == kind]
+        if titles: logging.info(f"{label}: {titles}")
+
+    # У каждой волны свой файл карты: волны могут рассылаться одновременно
+    screenshot_path = f"alerts_map_{time.time_ns()}.png"
+    if config.NOTIFICATION_MODE == "text_first":
+        # Карта рендерится параллельно с рассылкой текста и догоняет его отдельным сообщением
+        map_task = asyncio.create_task(take_alert_map(screenshot_path, alerts_state))
+        delivered = await queue_wave(events, None, wave)
+        asyncio.create_task(attach_map_to_messages(map_task, delivered, detected_at))
+        return
+
+    screenshot_path = await take_alert_map(screenshot_path, alerts_state)
+    delivered = await queue_wave(events, screenshot_path, wave)
+    asyncio.create_task(finish_map_wave(delivered, screenshot_path, detected_at))
+
+async def take_alert_map(path: str, alerts_state: dict) -> str | None:
+    if config.MAP_RENDERER == "browser":
+        return await take_alert_map_screenshot(path)
+    return await map_renderer.render(path, alerts_state)
+
+async def queue_wave(events: list[AlertEvent], image_path: str | None, wave: str) -> asyncio.Future:
+    """Ставит волну в очередь в этом процессе или через процессы-шарды.
+
+    Возвращает future, который завершится после рассылки: с отправленными сообщениями,
+    а в режиме шардов — с номером волны (сообщения хранят сами шарды).
+    """
+    if shard_pool:
+        return await shard_pool.notify(events, image_path, db.subscriptions.version, wave)
+    return await notify_all(events, image_path, wave)
+
+async def finish_map_wave(delivered: asyncio.Future, screenshot_path: str | None, detected_at: float):
+    try:
+        await delivered
+        metrics.wave_delivery_seconds.observe(time.monotonic() - detected_at, stage="text")
+        if screenshot_path:
+            metrics.wave_delivery_seconds.observe(time.monotonic() - detected_at, stage="map")
+        logging.info(f"Сповіщення з мапою доставлено за {time.monotonic() - detected_at:.2f} с")
+    finally:
+        if screenshot_path:
+            media_cache.discard(screenshot_path)
+            if os.path.exists(screenshot_path):
+                os.remove(screenshot_path)
+
+async def attach_map_to_messages(map_task: asyncio.Task, delivered: asyncio.Future, detected_at: float):
+    sent = await delivered
+    metrics.wave_delivery_seconds.observe(time.monotonic() - detected_at, stage="text")
+    logging.info(f"Текстові сповіщення доставлено за {time.monotonic() - detected_at:.2f} с")
+    screenshot_path = await map_task
+    try:
+        if shard_pool:
+            # Шардам сообщаем даже о неудачном скриншоте, чтобы они забыли сообщения этой волны
+            await shard_pool.attach_map(sent, screenshot_path)
+        elif screenshot_path:
+            await send_map_replies(sent, screenshot_path)
+        if screenshot_path:
+            metrics.wave_delivery_seconds.observe(time.monotonic() - detected_at, stage="map")
+            logging.info(f"Мапу доставлено за {time.monotonic() - detected_at:.2f} с")
+    finally:
+        if screenshot_path:
+            media_cache.discard(screenshot_path)
+            if os.path.exists(screenshot_path):
+                os.remove(screenshot_path)
+
+async def send_map_replies(sent_messages: list, screenshot_path: str):
+    # Одна карта на канал: отвечаем на последнее текстовое сообщение в каждом чате
+    last_messages = {message.chat.id: message for message in sent_messages if message}
+    deliveries = [
+        delivery.submit(chat_id, partial(media_cache.send_photo, bot, chat_id, screenshot_path,
+                                         reply_to_message_id=message.message_id))
+        for chat_id, message in last_messages.items()
+    ]
+    await asyncio.gather(*deliveries)
+
+def submit_tracked(key: str, channel_id: int, message_text: str, image_path: str | None,
+                   priority: int = PRIORITY_BACKGROUND) -> asyncio.Future:
+    """Ставит строку outbox в очередь доставки; результат отправки попадёт в outbox."""
+    future = delivery.submit(channel_id, partial(send_notification, channel_id, message_text, image_path), priority)
+    future.add_done_callback(partial(outbox.record_result, key))
+    return future
+
+async def send_notification(channel_id: int, message_text: str, image_path: str | None):
+    if image_path:
+        return await media_cache.send_photo(bot, channel_id, image_path, caption=message_text)
+    text_with_link = message_text + MAP_LINK
+    return await bot.send_message(channel_id, text_with_link, disable_web_page_preview=True)
+
+def render_change(channel, event: AlertEvent) -> str:
+    # Смена типа тревоги оформляется как начало тревоги нового типа
+    if event.kind == "end":
+        msg_template = channel['end_alert_message' if event.alert_type == "air_raid" else 'end_artillery_message']
+    else:
+        msg_template = channel['alert_message' if event.alert_type == "air_raid" else 'artillery_message']
+    return msg_template.format(region=event.region)
+
+def event_priority(event: AlertEvent) -> int:
+    if event.kind == "end":
+        return PRIORITY_END
+    return PRIORITY_AIR_RAID if event.alert_type == "air_raid" else PRIORITY_START
+
+async def notify_all(events: list[AlertEvent], image_path: str | None, wave: str) -> asyncio.Future:
+    """Записывает волну в outbox и ставит в очередь. Future завершится списком отправленных сообщений."""
+    if config.DIGEST_MODE:
+        return await notify_digest(events, image_path, wave)
+    return await notify_about_changes(events, image_path, wave)
+
+async def notify_about_changes(events: list[AlertEvent], image_path: str | None, wave: str) -> asyncio.Future:
+    rows, priorities = [], {}
+    # Обходим сначала события (срочные первыми), затем каналы: соседние задачи в очереди идут в разные чаты
+    for event in sorted(events, key=event_priority):
+        priority = event_priority(event)
+        for channel in db.subscriptions.subscribers(event.oblast):
+            channel_id = channel['channel_id']
+            key = f"{wave}:{channel_id}:{event.uid}:{event.kind}"
+            rows.append((key, channel_id, render_change(channel, event), image_path))
+            priorities[key] = priority
+
+    # Строки, уже записанные в outbox до перезапуска, досылает фоновый цикл outbox
+    rows = await outbox.enqueue(rows)
+    deliveries = [submit_tracked(*row, priority=priorities[row[0]]) for row in rows]
+    return asyncio.ensure_future(_finish_delivery(deliveries))
+
+async def _finish_delivery(deliveries: list) -> list:
+    sent_messages = await asyncio.gather(*deliveries)
+    await outbox.flush()
+    return sent_messages
+
+async def notify_digest(events: list[AlertEvent], image_path: str | None, wave: str) -> asyncio.Future:
+    """Собирает все изменения цикла в одно сообщение на канал (с разбиением по лимитам Telegram)."""
+    digests, priorities = {}, {}
+    for event in sorted(events, key=event_priority):
+        for channel in db.subscriptions.subscribers(event.oblast):
+            channel_id = channel['channel_id']
+            digests.setdefault(channel_id, []).append(render_change(channel, event))
+            # Дайджест идёт с приоритетом самого срочного события в нём
+            priorities[channel_id] = min(priorities.get(channel_id, PRIORITY_BACKGROUND), event_priority(event))
+
+    first_limit = CAPTION_LIMIT if image_path else MESSAGE_LIMIT - len(MAP_LINK)
+    rows = []
+    for channel_id, lines in digests.items():
+        for index, part in enumerate(split_message(lines, first_limit, MESSAGE_LIMIT - len(MAP_LINK))):
+            rows.append((f"{wave}:{channel_id}:digest:{index}", channel_id, part, image_path if index == 0 else None))
+
+    parts_by_channel = {}
+    for row in await outbox.enqueue(rows):
+        parts_by_channel.setdefault(row[1], []).append(row)
+    deliveries = [asyncio.ensure_future(_deliver_digest(parts, priorities[channel_id]))
+                  for channel_id, parts in parts_by_channel.items()]
+    return asyncio.ensure_future(_finish_digest(deliveries))
+
+async def _deliver_digest(parts: list[tuple], priority: int) -> list:
+    # Части одного дайджеста отправляем строго по очереди, чтобы они не перемешались в канале
+    sent_messages = []
+    for row in parts:
+        sent_messages.append(await submit_tracked(*row, priority=priority))
+    return sent_messages
+
+async def _finish_digest(deliveries: list) -> list:
+    results = await _finish_delivery(deliveries)
+    return [message for messages in results for message in messages]
+
+
+async def handle_ready(request: web.Request) -> web.Response:
+    if ready.is_set():
+        return web.Response(text="ok")
+    return web.Response(status=503, text="starting")
+
+async def start_http_server(webhook_secret: str | None = None) -> web.AppRunner | None:
+    """Общий HTTP-сервер бота: метрики Prometheus, проверка готовности и, в режиме webhook, приём обновлений Telegram."""
+    if not config.METRICS_ENABLED and not config.READINESS_PATH and not webhook_secret:
+        return None
+    app = web.Application()
+    if config.METRICS_ENABLED:
+        app.router.add_get(config.METRICS_PATH, metrics.handle_metrics)
+    if config.READINESS_PATH:
+        app.router.add_get(config.READINESS_PATH, handle_ready)
+    if webhook_secret:
+        from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+        SimpleRequestHandler(dispatcher=dp, bot=bot, secret_token=webhook_secret).register(app, path=config.WEBHOOK_PATH)
+        setup_application(app, dp, bot=bot)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, config.HTTP_HOST, config.HTTP_PORT).start()
+    logging.info(f"HTTP-сервер запущено на {config.HTTP_HOST}:{config.HTTP_PORT}")
+    return runner
+
+async def load_channel_titles():
+    channel_titles.load(await db.get_all_known_channels())
+
+async def add_owner_admin():
+    await db.add_admin(config.BOT_OWNER_ID)
+    logging.info(f"Власника бота ({config.BOT_OWNER_ID}) додано до адміністраторів.")
 
 async def main():
-    db.init_db()
-    db.add_admin(config.BOT_OWNER_ID)
-    logging.info(f"Власника бота ({config.BOT_OWNER_ID}) додано до адміністраторів.")
-    asyncio.create_task(check_alerts())
-    await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
+    global shard_pool
+    # Первый опрос API запускается как можно раньше; всё, что ему не нужно, готовится параллельно
+    await db.init_db()
+    delivery.start()
+    if config.DELIVERY_SHARDS > 1:
+        shard_pool = ShardPool(config.DELIVERY_SHARDS, __name__)
+        shard_pool.start()
+    reconcile, *_ = await asyncio.gather(restore_alerts_state(), load_channel_titles(), add_owner_admin())
+    asyncio.create_task(check_alerts(reconcile))
+    # Досылает то, что не ушло до перезапуска или упало с ошибкой. С шардами каждую строку повторяет
+    # шард-владелец канала: лидер сам не рассылает и не расходует их долю лимита Telegram
+    asyncio.create_task(outbox.run(shard_pool.retry if shard_pool else partial(outbox.retry, submit=submit_tracked)))
+    asyncio.create_task(map_screenshotter.start() if config.MAP_RENDERER == "browser" else map_renderer.start())
+    # Секрет webhook, если не задан в конфиге, генерируется заново при каждом запуске
+    webhook_secret = (config.WEBHOOK_SECRET or secrets.token_urlsafe(32)) if config.RUN_MODE == "webhook" else None
+    http_runner = await start_http_server(webhook_secret)
+    logging.info(f"Запуск зайняв {time.monotonic() - STARTUP_STARTED:.2f} с, очікуємо перше опитування")
+    try:
+        if webhook_secret:
+            await bot.set_webhook(f"{config.WEBHOOK_BASE_URL}{config.WEBHOOK_PATH}", secret_token=webhook_secret,
+                                  allowed_updates=dp.resolve_used_update_types())
+            logging.info("Бот працює в режимі webhook")
+            await asyncio.Event().wait()
+        else:
+            await bot.delete_webhook()
+            await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
+    finally:
+        if http_runner:
+            await http_runner.cleanup()
+        await map_screenshotter.close()
+        if shard_pool:
+            await shard_pool.stop()
+        await outbox.flush()
+        await db.close_db()
 
 if __name__ == "__main__":
     asyncio.run(main())
@@ -0,0 +1,249 @@
+# map_renderer.py
+"""Карта тревог без браузера: области из map_regions.json закрашиваются по типу тревоги и сохраняются в PNG.
+
+Растеризация областей делается один раз: дальше каждая карта — это копия готовой подложки,
+заливка нужных областей и сжатие через zlib.
+"""
+import asyncio
+import json
+import logging
+import math
+import os
+import struct
+import time
+import zlib
+from collections import OrderedDict
+
+import config
+import metrics
+from alert_events import ALERT_TYPE_PRIORITY
+
+GEOMETRY_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "map_regions.json")
+
+BACKGROUND_COLOR = (0x1b, 0x1f, 0x27)
+CALM_COLOR = (0x3b, 0x4d, 0x41)
+BORDER_COLOR = (0xe6, 0xe6, 0xe6)
+ALERT_COLORS = {
+    "air_raid": (0xd6, 0x3a, 0x3a),
+    "artillery_shelling": (0xef, 0x8a, 0x24),
+    "urban_fights": (0x9b, 0x4d, 0xca),
+    "chemical": (0x2f, 0xa8, 0x9a),
+    "nuclear": (0xf2, 0xc5, 0x1b),
+}
+UNKNOWN_ALERT_COLOR = (0xd6, 0x3a, 0x3a)
+
+# Индексы в палитре PNG
+BACKGROUND, CALM, BORDER = 0, 1, 2
+
+
+def _mix(color, other, share):
+    return tuple(round(a * (1 - share) + b * share) for a, b in zip(color, other))
+
+
+def _build_palette():
+    """Палитра: фон, спокойная область, граница, затем для каждого типа тревоги полный и частичный цвет."""
+    palette = [BACKGROUND_COLOR, CALM_COLOR, BORDER_COLOR]
+    indices = {}
+    for alert_type in (*ALERT_TYPE_PRIORITY, None):
+        color = ALERT_COLORS.get(alert_type, UNKNOWN_ALERT_COLOR)
+        # Тревога только в части области (район, громада) — приглушённый цвет того же типа
+        indices[alert_type] = (len(palette), len(palette) + 1)
+        palette += [color, _mix(color, CALM_COLOR, 0.55)]
+    return palette, indices
+
+
+PALETTE, COLOR_INDICES = _build_palette()
+
+
+def _type_rank(alert_type):
+    try: return ALERT_TYPE_PRIORITY.index(alert_type)
+    except ValueError: return len(ALERT_TYPE_PRIORITY)
+
+
+def region_colors(alerts_state: dict) -> dict:
+    """Индекс цвета палитры для каждой области с тревогой по состоянию из parse_alerts."""
+    full, partial = {}, {}
+    for title, alert_type, location_type, oblast in alerts_state.values():
+        target = full if location_type == "oblast" or title == oblast else partial
+        current = target.get(oblast)
+        if current is None or _type_rank(alert_type) < _type_rank(current):
+            target[oblast] = alert_type
+    colors = {}
+    for oblast, alert_type in partial.items():
+        colors[oblast] = COLOR_INDICES.get(alert_type, COLOR_INDICES[None])[1]
+    for oblast, alert_type in full.items():
+        colors[oblast] = COLOR_INDICES.get(alert_type, COLOR_INDICES[None])[0]
+    return colors
+
+
+def _scanline_spans(rings, width, height):
+    """Заливка колец по правилу even-odd (дырки и острова работают сами): список (y, x_start, x_end)."""
+    edges = []
+    for ring in rings:
+        for (x0, y0), (x1, y1) in zip(ring, ring[1:] + ring[:1]):
+            if y0 == y1:
+                continue
+            if y0 > y1:
+                x0, y0, x1, y1 = x1, y1, x0, y0
+            # Строка y закрашивается, если её центр y + 0.5 попадает в [y0, y1)
+            first_row = max(0, math.ceil(y0 - 0.5))
+            last_row = min(height - 1, math.ceil(y1 - 0.5) - 1)
+            if first_row <= last_row:
+                edges.append((first_row, last_row, x0, y0, (x1 - x0) / (y1 - y0)))
+    edges.sort()
+
+    spans, active, next_edge = [], [], 0
+    for row in range(edges[0][0] if edges else 0, height):
+        while next_edge < len(edges) and edges[next_edge][0] == row:
+            active.append(edges[next_edge])
+            next_edge += 1
+        active = [edge for edge in active if edge[1] >= row]
+        if not active and next_edge >= len(edges):
+            break
+        center = row + 0.5
+        crossings = sorted(x0 + (center - y0) * slope for _, _, x0, y0, slope in active)
+        for left, right in zip(crossings[::2], crossings[1::2]):
+            start, end = max(0, math.ceil(left - 0.5)), min(width, math.ceil(right - 0.5))
+            if start < end:
+                spans.append((row, start, end))
+    return spans
+
+
+def _draw_ring(mask, ring, width, height, value):
+    for (x0, y0), (x1, y1) in zip(ring, ring[1:] + ring[:1]):
+        steps = max(1, int(max(abs(x1 - x0), abs(y1 - y0))))
+        for step in range(steps + 1):
+            x = int(x0 + (x1 - x0) * step / steps)
+            y = int(y0 + (y1 - y0) * step / steps)
+            if 0 <= x < width and 0 <= y < height:
+                mask[y * width + x] = value
+
+
+def _png_chunk(kind: bytes, data: bytes) -> bytes:
+    return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+
+def encode_png(pixels, width: int, height: int, palette) -> bytes:
+    """PNG с палитрой (8 бит на пиксель) из плоского буфера индексов."""
+    view = memoryview(pixels)
+    raw = b"".join(b"\x00" + view[row * width:(row + 1) * width] for row in range(height))
+    return b"".join((
+        b"\x89PNG\r\n\x1a\n",
+        _png_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 3, 0, 0, 0)),
+        _png_chunk(b"PLTE", bytes(channel for color in palette for channel in color)),
+        _png_chunk(b"IDAT", zlib.compress(raw, 6)),
+        _png_chunk(b"IEND", b""),
+    ))
+
+
+class MapRenderer:
+    """Рисует карту из локальной геометрии. Подложка и заливки областей считаются один раз и кэшируются."""
+
+    def __init__(self, geometry_path: str, width: int, padding: int = 16, cache_size: int = 8):
+        self.geometry_path = geometry_path
+        self.width = width
+        self.height = 0
+        self.padding = padding
+        self._base = None          # подложка: индексы палитры с границами областей
+        self._fills = {}           # область -> [(смещение, длина)] внутренних пикселей без границ
+        self._rendered = OrderedDict()   # набор цветов -> PNG
+        self._cache_size = cache_size
+        self._lock = asyncio.Lock()
+
+    def _project(self, regions: dict) -> dict:
+        points = [point for rings in regions.values() for ring in rings for point in ring]
+        min_lon, max_lon = min(p[0] for p in points), max(p[0] for p in points)
+        min_lat, max_lat = min(p[1] for p in points), max(p[1] for p in points)
+        # Равнопромежуточная проекция с поправкой на широту — для одной страны искажения незаметны
+        x_scale = math.cos(math.radians((min_lat + max_lat) / 2))
+        scale = (self.width - 2 * self.padding) / ((max_lon - min_lon) * x_scale)
+        self.height = math.ceil((max_lat - min_lat) * scale) + 2 * self.padding
+        return {
+            region: [[((lon - min_lon) * x_scale * scale + self.padding, (max_lat - lat) * scale + self.padding)
+                      for lon, lat in ring] for ring in rings]
+            for region, rings in regions.items()
+        }
+
+    def _build(self):
+        if self._base is not None:
+            return
+        started = time.perf_counter()
+        with open(self.geometry_path, encoding="utf-8") as file:
+            regions = self._project(json.load(file)["regions"])
+        width, height = self.width, self.height
+
+        mask = bytearray(width * height)
+        spans = {region: _scanline_spans(rings, width, height) for region, rings in regions.items()}
+        for region_spans in spans.values():
+            for row, start, end in region_spans:
+                mask[row * width + start:row * width + end] = bytes([CALM]) * (end - start)
+        for rings in regions.values():
+            for ring in rings:
+                _draw_ring(mask, ring, width, height, BORDER)
+
+        # Заливка не должна затирать границы, поэтому из отрезков вырезаются пиксели границ
+        border = bytes([BORDER])
+        fills = {}
+        for region, region_spans in spans.items():
+            pieces = []
+            for row, start, end in region_spans:
+                position, stop = row * width + start, row * width + end
+                while position < stop:
+                    border_at = mask.find(border, position, stop)
+                    if border_at == -1:
+                        border_at = stop
+                    if border_at > position:
+                        pieces.append((position, border_at - position))
+                    position = border_at + 1
+            fills[region] = pieces
+        self._fills = fills
+        self._base = bytes(mask)
+        logging.info(f"Підкладку мапи побудовано за {time.perf_counter() - started:.2f} с")
+
+    def render_png(self, colors: dict) -> bytes:
+        """PNG для набора {область: индекс палитры}; одинаковые наборы берутся из кэша."""
+        key = tuple(sorted(colors.items()))
+        png = self._rendered.get(key)
+        if png is not None:
+            self._rendered.move_to_end(key)
+            return png
+        self._build()
+        pixels = bytearray(self._base)
+        for region, color in colors.items():
+            fill = bytes([color])
+            for offset, length in self._fills.get(region, ()):
+                pixels[offset:offset + length] = fill * length
+        png = encode_png(pixels, self.width, self.height, PALETTE)
+        self._rendered[key] = png
+        if len(self._rendered) > self._cache_size:
+            self._rendered.popitem(last=False)
+        return png
+
+    def _render_to_file(self, path: str, colors: dict):
+        png = self.render_png(colors)
+        with open(path, "wb") as file:
+            file.write(png)
+
+    async def start(self):
+        """Строит подложку заранее, чтобы первая тревога не ждала растеризации."""
+        async with self._lock:
+            try:
+                await asyncio.get_running_loop().run_in_executor(None, self._build)
+            except Exception as e:
+                logging.error(f"Не вдалося підготувати мапу: {e}")
+
+    async def render(self, path: str, alerts_state: dict) -> str | None:
+        async with self._lock:
+            started = time.perf_counter()
+            try:
+                colors = region_colors(alerts_state)
+                await asyncio.get_running_loop().run_in_executor(None, self._render_to_file, path, colors)
+                metrics.screenshot_seconds.observe(time.perf_counter() - started, result="ok")
+                return path
+            except Exception as e:
+                metrics.screenshot_seconds.observe(time.perf_counter() - started, result="error")
+                logging.error(f"Помилка при малюванні мапи: {e}")
+                return None
+
+
+map_renderer = MapRenderer(GEOMETRY_PATH, config.MAP_WIDTH)
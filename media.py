@@ -0,0 +1,77 @@
+# media.py
+import asyncio
+import logging
+import os
+from collections import OrderedDict
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import FSInputFile, Message
+
+
+class MediaCache:
+    """Кэш file_id: файл загружается в Telegram один раз, дальше отправляется по file_id.
+
+    У каждой волны свой файл карты, а волны могут рассылаться одновременно, поэтому file_id
+    хранятся по пути (LRU), и загрузки разных файлов друг друга не ждут.
+    """
+
+    def __init__(self, maxsize: int = 8):
+        self.maxsize = maxsize
+        self._file_ids = OrderedDict()   # путь -> (mtime_ns, file_id)
+        self._locks = {}                 # путь -> asyncio.Lock на время загрузки
+
+    @staticmethod
+    def _make_key(path: str):
+        # Если файл перезаписали, mtime отделяет новую карту от старой
+        try:
+            return path, os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+
+    def _cached_file_id(self, key) -> str | None:
+        if key is None:
+            return None
+        entry = self._file_ids.get(key[0])
+        if entry is None or entry[0] != key[1]:
+            return None
+        self._file_ids.move_to_end(key[0])
+        return entry[1]
+
+    def _remember(self, key, file_id: str):
+        self._file_ids[key[0]] = (key[1], file_id)
+        self._file_ids.move_to_end(key[0])
+        if len(self._file_ids) > self.maxsize:
+            evicted, _ = self._file_ids.popitem(last=False)
+            lock = self._locks.get(evicted)
+            if lock is not None and not lock.locked():
+                del self._locks[evicted]
+
+    def discard(self, path: str):
+        """Забывает файл, который больше не будет отправляться (например, удалённую карту волны)."""
+        self._file_ids.pop(path, None)
+        self._locks.pop(path, None)
+
+    async def send_photo(self, bot: Bot, chat_id: int, path: str, **kwargs) -> Message:
+        key = self._make_key(path)
+        cached_id = self._cached_file_id(key)
+        if cached_id:
+            try:
+                return await bot.send_photo(chat_id, cached_id, **kwargs)
+            except TelegramBadRequest as e:
+                logging.warning(f"Telegram відхилив кешований file_id, завантажуємо файл повторно: {e}")
+                if self._cached_file_id(key) == cached_id:
+                    self._file_ids.pop(path, None)
+
+        async with self._locks.setdefault(path, asyncio.Lock()):
+            # Пока мы ждали, другой воркер мог уже загрузить этот файл
+            file_id = self._cached_file_id(key)
+            if file_id and file_id != cached_id:
+                return await bot.send_photo(chat_id, file_id, **kwargs)
+            message = await bot.send_photo(chat_id, FSInputFile(path=path), **kwargs)
+            if message.photo and key is not None:
+                self._remember(key, message.photo[-1].file_id)
+            return message
+
+
+media_cache = MediaCache()
@@ -0,0 +1,200 @@
+# metrics.py
+"""Метрики в текстовом формате Prometheus без внешних зависимостей.
+
+Процессы-шарды пересылают снимки своих метрик лидеру (snapshot/merge_remote), и /metrics лидера
+показывает сумму по всем процессам.
+"""
+import time
+from contextlib import contextmanager
+
+from aiohttp import web
+
+_registry = []
+_remote = {}     # номер шарда -> последний снимок его метрик
+_retired = {}    # имя метрики -> накопленные значения шардов, которые были перезапущены
+
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+def _format_labels(names, values, extra=None) -> str:
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in pairs) + "}"
+
+
+class _Metric:
+    kind = "untyped"
+    mergeable = False     # суммируется ли со значениями из других процессов
+
+    def __init__(self, name: str, documentation: str, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        _registry.append(self)
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+    def render(self) -> list[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+    def snapshot(self):
+        return None
+
+    @staticmethod
+    def _combine(total, values):
+        return total
+
+    def _merged(self, own):
+        """Собственные значения плюс снимки шардов (own изменяется на месте)."""
+        for snapshot in (_retired, *_remote.values()):
+            if self.name in snapshot:
+                own = self._combine(own, snapshot[self.name])
+        return own
+
+
+class Counter(_Metric):
+    kind = "counter"
+    mergeable = True
+
+    def __init__(self, name, documentation, labels=()):
+        super().__init__(name, documentation, labels)
+        self._values = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def snapshot(self):
+        return dict(self._values)
+
+    @staticmethod
+    def _combine(total, values):
+        for key, value in values.items():
+            total[key] = total.get(key, 0) + value
+        return total
+
+    def render(self):
+        lines = super().render()
+        for key, value in self._merged(self.snapshot()).items():
+            lines.append(f"{self.name}{_format_labels(self.label_names, key)} {value}")
+        return lines
+
+
+class Gauge(_Metric):
+    """Значение берётся из функции в момент сбора метрик. aggregate=True — суммировать по процессам-шардам."""
+    kind = "gauge"
+
+    def __init__(self, name, documentation, getter, aggregate: bool = False):
+        super().__init__(name, documentation)
+        self.getter = getter
+        self.mergeable = aggregate
+
+    def snapshot(self):
+        return self.getter()
+
+    @staticmethod
+    def _combine(total, value):
+        return total + value
+
+    def render(self):
+        value = self._merged(self.getter()) if self.mergeable else self.getter()
+        return super().render() + [f"{self.name} {value}"]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+    mergeable = True
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+        self._values = {}    # ключ меток -> [счётчики по бакетам, сумма, количество]
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        series = self._values.get(key)
+        if series is None:
+            series = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[0][index] += 1
+        series[1] += value
+        series[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def snapshot(self):
+        return {key: [list(counts), total, count] for key, (counts, total, count) in self._values.items()}
+
+    @staticmethod
+    def _combine(total, values):
+        for key, (counts, value_sum, count) in values.items():
+            series = total.get(key)
+            if series is None:
+                total[key] = [list(counts), value_sum, count]
+                continue
+            series[0] = [a + b for a, b in zip(series[0], counts)]
+            series[1] += value_sum
+            series[2] += count
+        return total
+
+    def render(self):
+        lines = super().render()
+        for key, (counts, total, count) in self._merged(self.snapshot()).items():
+            for bound, bucket_count in zip(self.buckets, counts):
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, ('le', bound))} {bucket_count}")
+            lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, ('le', '+Inf'))} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, key)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, key)} {count}")
+        return lines
+
+
+def snapshot() -> dict:
+    """Значения метрик этого процесса для пересылки лидеру."""
+    return {metric.name: metric.snapshot() for metric in _registry if metric.mergeable}
+
+
+def merge_remote(source: int, values: dict):
+    """Запоминает последний снимок шарда; снимки накопительные, поэтому предыдущий просто заменяется."""
+    _remote[source] = values
+
+
+def retire_remote(source: int):
+    """Шард перезапускается с нуля: его счётчики и гистограммы сохраняются, чтобы сумма не уменьшилась."""
+    values = _remote.pop(source, None) or {}
+    for metric in _registry:
+        if metric.name in values and metric.kind != "gauge":
+            _retired[metric.name] = metric._combine(_retired.get(metric.name, {}), values[metric.name])
+
+
+def render() -> str:
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+async def handle_metrics(request: web.Request) -> web.Response:
+    return web.Response(body=render().encode(), headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+
+# --- Метрики бота ---
+
+api_poll_seconds = Histogram("alerts_api_poll_seconds", "Duration of alerts API requests", ("status",))
+screenshot_seconds = Histogram("screenshot_render_seconds", "Alert map screenshot render time", ("result",))
+send_seconds = Histogram("telegram_send_seconds", "Latency of a single Telegram send", ("result",),
+                         buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10))
+retry_after_total = Counter("telegram_retry_after_total", "Telegram 429 (RetryAfter) responses")
+wave_delivery_seconds = Histogram("wave_delivery_seconds", "Time from alert detection to the last delivered message of a wave", ("stage",))
+alert_events_suppressed_total = Counter("alert_events_suppressed_total",
+                                        "Alert changes merged or cancelled within the coalescing window", ("kind",))
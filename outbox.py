@@ -0,0 +1,114 @@
+# outbox.py
+"""Надёжная доставка: каждое уведомление сначала записывается в таблицу outbox, а неотправленные
+повторяются с экспоненциальной паузой — в том числе после перезапуска процесса."""
+import asyncio
+import logging
+import math
+import os
+import time
+
+import config
+import database as db
+
+
+class Outbox:
+    def __init__(self, max_attempts: int, retry_base: float, retry_max: float, lease: float):
+        self.max_attempts = max_attempts
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self.lease = lease
+        self.started_at = time.time()
+        self._in_flight = {}    # ключ -> число уже сделанных попыток
+        self._finished = {}     # ключ -> (попыток после завершения, время): защита от устаревших повторов
+        self._sent = []
+        self._failed = []
+        self._last_purge = 0.0
+
+    async def enqueue(self, rows: list[tuple]) -> list[tuple]:
+        """Записывает (ключ, channel_id, текст, путь к картинке) одной транзакцией.
+
+        Возвращает только новые строки: уже известные ключи либо отправлены, либо будут повторены из outbox.
+        """
+        if not rows:
+            return []
+        new_rows = await db.enqueue_outbox(rows, time.time())
+        for row in new_rows:
+            self._in_flight[row[0]] = 0
+        return new_rows
+
+    def record_result(self, key: str, future: asyncio.Future):
+        attempts = self._in_flight.pop(key, 0)
+        self._finished.pop(key, None)   # порядок вставки = порядок завершения, по нему чистится словарь
+        if not future.cancelled() and future.result() is not None:
+            self._sent.append(key)
+            self._finished[key] = (math.inf, time.monotonic())
+            return
+        attempts += 1
+        self._finished[key] = (attempts, time.monotonic())
+        delay = min(self.retry_max, self.retry_base * 2 ** (attempts - 1))
+        status = 'failed' if attempts >= self.max_attempts else 'pending'
+        self._failed.append((attempts, time.time() + delay, status, key))
+
+    async def flush(self):
+        """Сохраняет накопленные результаты отправки одной транзакцией."""
+        if not self._sent and not self._failed:
+            return
+        sent, self._sent = self._sent, []
+        failed, self._failed = self._failed, []
+        await db.complete_outbox(sent, failed)
+        # Строки, выбранные лидером до этой записи, могут прийти ещё раз; через несколько циклов их уже нет
+        expired = time.monotonic() - 10 * config.OUTBOX_POLL_INTERVAL
+        while self._finished:
+            key, (_, finished_at) = next(iter(self._finished.items()))
+            if finished_at > expired:
+                break
+            del self._finished[key]
+        for attempts, _, status, key in failed:
+            if status == 'failed':
+                logging.error(f"Повідомлення {key} не доставлено після {attempts} спроб")
+
+    def retry(self, rows: list[tuple], submit):
+        """Повторяет строки (key, channel_id, текст, картинка, attempts) через submit(key, channel_id, text, image).
+
+        Ключи, которые этот процесс уже отправляет, пропускаются: повтор должен выполнять тот процесс,
+        который строку записал, иначе он не отличит брошенную строку от ещё стоящей в очереди.
+        """
+        for key, channel_id, message_text, image_path, attempts in rows:
+            # Строка, прочитанная до того, как результат её отправки попал в БД, устарела
+            if key in self._in_flight or attempts < self._finished.get(key, (0,))[0]:
+                continue
+            self._in_flight[key] = attempts
+            if image_path and not os.path.exists(image_path):
+                image_path = None
+            submit(key, channel_id, message_text, image_path)
+
+    async def run(self, dispatch=None):
+        """Фоновый цикл: сохраняет результаты отправок и передаёт просроченные строки в dispatch(rows).
+
+        Без dispatch (в процессах-шардах) только сохраняет результаты: повторы им раздаёт лидер.
+        """
+        while True:
+            await asyncio.sleep(config.OUTBOX_POLL_INTERVAL)
+            try:
+                await self.flush()
+                if dispatch is None:
+                    continue
+                now = time.time()
+                # Строки без попыток, созданные этим запуском, сейчас в работе у этого процесса
+                # или у процессов-шардов; их забираем только после истечения аренды
+                rows = await db.get_due_outbox(now, max(self.started_at, now - self.lease), config.OUTBOX_BATCH_SIZE)
+                if rows:
+                    dispatch(rows)
+                if now - self._last_purge > 60 * 60:
+                    await db.purge_outbox(now - config.OUTBOX_RETENTION)
+                    self._last_purge = now
+            except Exception as e:
+                logging.error(f"Помилка в циклі outbox: {e}")
+
+
+outbox = Outbox(
+    max_attempts=config.OUTBOX_MAX_ATTEMPTS,
+    retry_base=config.OUTBOX_RETRY_BASE,
+    retry_max=config.OUTBOX_RETRY_MAX,
+    lease=config.OUTBOX_LEASE,
+)
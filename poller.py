@@ -0,0 +1,76 @@
+# poller.py
+import hashlib
+import json
+import random
+import time
+
+import aiohttp
+
+import metrics
+
+
+class AlertsAPIError(Exception):
+    def __init__(self, status: int):
+        super().__init__(f"HTTP {status}")
+        self.status = status
+
+
+class AlertsPoller:
+    """Условные запросы к API тревог: ETag/If-Modified-Since, пропуск неизменившихся ответов и бэкофф."""
+
+    def __init__(self, session: aiohttp.ClientSession, url: str, interval: float, max_backoff: float):
+        self.session = session
+        self.url = url
+        self.interval = interval
+        self.max_backoff = max_backoff
+        self._etag = None
+        self._last_modified = None
+        self._payload_hash = None
+        self._pending = None
+        self._errors = 0
+        self._last_status = None
+
+    async def fetch(self) -> dict | None:
+        """Возвращает разобранный ответ или None, если с прошлого обработанного опроса ничего не изменилось."""
+        started = time.perf_counter()
+        self._last_status = None
+        try:
+            return await self._fetch()
+        finally:
+            # Сетевые ошибки и таймауты не дают HTTP-статуса
+            metrics.api_poll_seconds.observe(time.perf_counter() - started, status=self._last_status or "error")
+
+    async def _fetch(self) -> dict | None:
+        headers = {}
+        if self._etag: headers["If-None-Match"] = self._etag
+        if self._last_modified: headers["If-Modified-Since"] = self._last_modified
+
+        async with self.session.get(self.url, headers=headers) as response:
+            self._last_status = response.status
+            if response.status == 304:
+                return None
+            if response.status != 200:
+                raise AlertsAPIError(response.status)
+            body = await response.read()
+            etag, last_modified = response.headers.get("ETag"), response.headers.get("Last-Modified")
+
+        payload_hash = hashlib.blake2b(body, digest_size=16).digest()
+        self._pending = (etag, last_modified, payload_hash)
+        if payload_hash == self._payload_hash:
+            self.mark_processed()
+            return None
+        return json.loads(body)
+
+    def mark_processed(self):
+        """Запоминает валидаторы ответа только после того, как он успешно обработан."""
+        if self._pending:
+            self._etag, self._last_modified, self._payload_hash = self._pending
+            self._pending = None
+
+    def next_delay(self, failed: bool) -> float:
+        if not failed:
+            self._errors = 0
+            return self.interval
+        self._errors += 1
+        delay = min(self.max_backoff, self.interval * 2 ** self._errors)
+        return random.uniform(delay / 2, delay)
@@ -0,0 +1,28 @@
+# regions.py
+# Номер региона — его индекс в списке. Номера хранятся в channel_regions и в callback_data кнопок,
+# поэтому новые регионы добавляются только в конец списка
+UKRAINE_REGIONS = [
+    "Вінницька область", "Волинська область", "Дніпропетровська область", "Донецька область",
+    "Житомирська область", "Закарпатська область", "Запорізька область", "Івано-Франківська область",
+    "Київська область", "Кіровоградська область", "Луганська область", "Львівська область",
+    "Миколаївська область", "Одеська область", "Полтавська область", "Рівненська область",
+    "Сумська область", "Тернопільська область", "Харківська область", "Херсонська область",
+    "Хмельницька область", "Черкаська область", "Чернівецька область", "Чернігівська область",
+    "м. Київ", "Автономна Республіка Крим"
+]
+
+REGION_IDS = {region: index for index, region in enumerate(UKRAINE_REGIONS)}
+
+
+def regions_to_mask(regions) -> int:
+    """Битовая маска выбранных регионов: бит i — регион UKRAINE_REGIONS[i]. Неизвестные названия пропускаются."""
+    mask = 0
+    for region in regions:
+        region_id = REGION_IDS.get(region)
+        if region_id is not None:
+            mask |= 1 << region_id
+    return mask
+
+
+def mask_to_regions(mask: int) -> list[str]:
+    return [region for region_id, region in enumerate(UKRAINE_REGIONS) if mask >> region_id & 1]
@@ -0,0 +1,94 @@
+# screenshot.py
+import asyncio
+import logging
+import time
+
+import config
+import metrics
+
+
+class MapScreenshotter:
+    """Держит запущенный Chromium с открытой картой тревог и делает скриншоты по запросу."""
+
+    def __init__(self, url: str, timeout: float):
+        self.url = url
+        self.timeout = timeout
+        self._playwright = None
+        self._browser = None
+        self._page = None
+        self._lock = asyncio.Lock()
+
+    def _is_healthy(self) -> bool:
+        return (self._browser is not None and self._browser.is_connected()
+                and self._page is not None and not self._page.is_closed())
+
+    async def _launch(self):
+        await self._reset()
+        # Playwright импортируется только когда браузер действительно нужен
+        from playwright.async_api import async_playwright
+        self._playwright = await async_playwright().start()
+        self._browser = await self._playwright.chromium.launch(headless=True)
+        self._page = await self._browser.new_page()
+        await self._page.set_viewport_size({"width": 1280, "height": 900})
+        await self._page.goto(self.url, timeout=self.timeout * 1000, wait_until="networkidle")
+        logging.info("Браузер для скріншотів карти запущено")
+
+    async def _reset(self):
+        # Закрываем всё, что осталось от предыдущего (возможно, упавшего) браузера
+        if self._browser is not None:
+            browser, self._browser, self._page = self._browser, None, None
+            try: await browser.close()
+            except Exception: pass
+        if self._playwright is not None:
+            playwright, self._playwright = self._playwright, None
+            try: await playwright.stop()
+            except Exception: pass
+
+    async def start(self):
+        """Прогревает браузер заранее, чтобы первая тревога не ждала его запуска."""
+        async with self._lock:
+            try:
+                await asyncio.wait_for(self._launch(), self.timeout)
+            except Exception as e:
+                logging.error(f"Не вдалося запустити браузер для скріншотів: {e}")
+                await self._reset()
+
+    async def close(self):
+        async with self._lock:
+            await self._reset()
+
+    async def _capture(self, path: str):
+        for attempt in range(2):
+            try:
+                if not self._is_healthy():
+                    await self._launch()
+                else:
+                    await self._page.reload(timeout=self.timeout * 1000, wait_until="networkidle")
+                await self._page.locator("#map").screenshot(path=path)
+                return
+            except Exception as e:
+                if attempt:
+                    raise
+                logging.warning(f"Браузер не відповідає, перезапускаємо: {e}")
+                await self._reset()
+
+    async def take(self, path: str = "alerts_map.png") -> str | None:
+        async with self._lock:
+            started = time.perf_counter()
+            try:
+                await asyncio.wait_for(self._capture(path), self.timeout)
+                metrics.screenshot_seconds.observe(time.perf_counter() - started, result="ok")
+                logging.info(f"Скріншот карти збережено: {path}")
+                return path
+            except Exception as e:
+                metrics.screenshot_seconds.observe(time.perf_counter() - started, result="error")
+                logging.error(f"Помилка при створенні скріншоту: {e}")
+                await self._reset()
+                return None
+
+
+map_screenshotter = MapScreenshotter(config.ALERTS_MAP_URL, config.SCREENSHOT_TIMEOUT)
+
+
+async def take_alert_map_screenshot(path: str = "alerts_map.png") -> str | None:
+    return await map_screenshotter.take(path)
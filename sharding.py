@@ -0,0 +1,212 @@
+# sharding.py
+"""Рассылка в нескольких процессах: лидер опрашивает API, процессы-шарды доставляют свою часть каналов.
+
+Канал принадлежит шарду channel_id % shards. Команды передаются через очереди multiprocessing,
+внешний брокер не нужен.
+"""
+import asyncio
+import importlib
+import itertools
+import logging
+import multiprocessing
+import queue
+import sys
+
+import config
+import metrics
+
+
+def shard_of(channel_id: int, shards: int) -> int:
+    return channel_id % shards
+
+
+class ShardPool:
+    """Сторона лидера: запускает процессы-шарды, рассылает им волны и ждёт подтверждений."""
+
+    def __init__(self, shards: int, app_module: str):
+        self.shards = shards
+        # Дочерний процесс, запущенный через spawn, видит главный скрипт лидера как __mp_main__
+        self.app_module = "__mp_main__" if app_module == "__main__" else app_module
+        self._context = multiprocessing.get_context("spawn")
+        self._tasks = [self._context.Queue() for _ in range(shards)]
+        self._results = self._context.Queue()
+        self._processes = [None] * shards
+        self._waiters = {}          # (номер волны, этап) -> (future, множество шардов без ответа)
+        self._wave_ids = itertools.count(1)
+        self._reader = None
+
+    def _spawn(self, shard: int):
+        process = self._context.Process(target=worker_entry, name=f"delivery-shard-{shard}", daemon=True,
+                                        args=(shard, self.shards, self.app_module, self._tasks[shard], self._results))
+        process.start()
+        self._processes[shard] = process
+
+    def start(self):
+        for shard in range(self.shards):
+            self._spawn(shard)
+        self._reader = asyncio.create_task(self._read_results())
+        logging.info(f"Запущено процесів доставки: {self.shards}")
+
+    async def stop(self):
+        for tasks in self._tasks:
+            tasks.put(None)
+        self._results.put(None)
+        if self._reader:
+            await self._reader
+        loop = asyncio.get_running_loop()
+        for process in self._processes:
+            await loop.run_in_executor(None, process.join, 10)
+
+    async def _read_results(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                result = await loop.run_in_executor(None, self._results.get, True, 1)
+            except queue.Empty:
+                self._check_processes()
+                continue
+            if result is None:
+                return
+            if result[0] == "metrics":
+                _, shard, values = result
+                metrics.merge_remote(shard, values)
+                continue
+            wave_id, stage, shard = result
+            self._acknowledge((wave_id, stage), shard)
+
+    def _acknowledge(self, waiter_key: tuple, shard: int):
+        waiter = self._waiters.get(waiter_key)
+        if waiter is None:
+            return
+        future, pending = waiter
+        pending.discard(shard)
+        if not pending:
+            del self._waiters[waiter_key]
+            if not future.done():
+                future.set_result(waiter_key[0])
+
+    def _check_processes(self):
+        for shard, process in enumerate(self._processes):
+            if process is not None and not process.is_alive():
+                logging.error(f"Процес доставки {shard} завершився (код {process.exitcode}), перезапускаємо")
+                metrics.retire_remote(shard)
+                self._spawn(shard)
+                # Команды, которые шард не успел подтвердить, считаем потерянными
+                for waiter_key in list(self._waiters):
+                    self._acknowledge(waiter_key, shard)
+
+    def _expect(self, wave_id: int, stage: str) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        self._waiters[(wave_id, stage)] = (future, set(range(self.shards)))
+        return future
+
+    def _broadcast(self, command: tuple):
+        for tasks in self._tasks:
+            tasks.put(command)
+
+    async def notify(self, events: list, image_path: str | None, subscriptions_version: int, wave: str) -> asyncio.Future:
+        """Ждёт, пока все шарды поставят волну в очередь. Возвращает future, который получит номер волны после рассылки."""
+        wave_id = next(self._wave_ids)
+        queued = self._expect(wave_id, "queued")
+        delivered = self._expect(wave_id, "delivered")
+        self._broadcast(("notify", wave_id, events, image_path, subscriptions_version, wave))
+        await queued
+        return delivered
+
+    def retry(self, rows: list[tuple]):
+        """Раздаёт просроченные строки outbox шардам — владельцам каналов."""
+        by_shard = {}
+        for row in rows:
+            # sqlite3.Row не передаётся между процессами
+            by_shard.setdefault(shard_of(row[1], self.shards), []).append(tuple(row))
+        for shard, shard_rows in by_shard.items():
+            self._tasks[shard].put(("retry", 0, shard_rows))
+
+    async def attach_map(self, wave_id: int, image_path: str | None):
+        attached = self._expect(wave_id, "attached")
+        self._broadcast(("attach", wave_id, image_path))
+        await attached
+
+
+def worker_entry(shard: int, shards: int, app_module: str, tasks, results):
+    asyncio.run(_run_worker(shard, shards, app_module, tasks, results))
+
+
+async def _run_worker(shard: int, shards: int, app_module: str, tasks, results):
+    import database as db
+    import delivery as delivery_module
+
+    app = sys.modules.get(app_module) or importlib.import_module(app_module)
+    # Глобальный лимит Telegram общий для токена, поэтому делим его между шардами
+    app.delivery = delivery_module.delivery = delivery_module.DeliveryEngine(
+        config.DELIVERY_WORKERS, config.GLOBAL_RATE_LIMIT / shards,
+        config.PER_CHAT_RATE_LIMIT, config.DELIVERY_MAX_RETRIES)
+    app.delivery.start()
+
+    loaded_version = None
+    sent_by_wave = {}
+    loop = asyncio.get_running_loop()
+
+    async def finish_wave(wave_id: int, delivered: asyncio.Future, keep_messages: bool):
+        try:
+            sent_messages = await delivered
+            if keep_messages:
+                sent_by_wave[wave_id] = sent_messages
+        except Exception as e:
+            logging.error(f"Помилка в процесі доставки {shard}: {e}")
+        results.put((wave_id, "delivered", shard))
+
+    async def attach_map(wave_id: int, image_path: str | None):
+        sent_messages = sent_by_wave.pop(wave_id, [])
+        try:
+            if image_path:
+                await app.send_map_replies(sent_messages, image_path)
+        except Exception as e:
+            logging.error(f"Помилка в процесі доставки {shard}: {e}")
+        if image_path:
+            # Файл удалит лидер, file_id этой карты шарду больше не понадобится
+            app.media_cache.discard(image_path)
+        results.put((wave_id, "attached", shard))
+
+    async def report_metrics():
+        # /metrics обслуживает только лидер, поэтому отправки, 429 и очередь шарда пересылаются ему
+        while True:
+            await asyncio.sleep(config.SHARD_METRICS_INTERVAL)
+            results.put(("metrics", shard, metrics.snapshot()))
+
+    reporter = asyncio.create_task(report_metrics())
+    outbox_flusher = asyncio.create_task(app.outbox.run())
+    try:
+        while True:
+            command = await loop.run_in_executor(None, tasks.get)
+            if command is None:
+                break
+            kind, wave_id = command[0], command[1]
+            if kind == "notify":
+                _, _, events, image_path, version, wave = command
+                try:
+                    if version != loaded_version:
+                        await db.load_subscriptions(lambda channel_id: shard_of(channel_id, shards) == shard)
+                        loaded_version = version
+                    # Результаты отправок шард пишет в общий outbox сам
+                    delivered = await app.notify_all(events, image_path, wave)
+                except Exception as e:
+                    logging.error(f"Помилка в процесі доставки {shard}: {e}")
+                    delivered = loop.create_future()
+                    delivered.set_result([])
+                results.put((wave_id, "queued", shard))
+                # Не ждём рассылку: следующая волна должна попасть в приоритетную очередь сразу
+                asyncio.create_task(finish_wave(wave_id, delivered, image_path is None))
+            elif kind == "attach":
+                asyncio.create_task(attach_map(wave_id, command[2]))
+            elif kind == "retry":
+                # Строки, которые шард ещё держит в очереди, outbox пропустит сам
+                app.outbox.retry(command[2], app.submit_tracked)
+    finally:
+        reporter.cancel()
+        outbox_flusher.cancel()
+        await app.delivery.stop()
+        results.put(("metrics", shard, metrics.snapshot()))
+        await app.outbox.flush()
+        await app.bot.session.close()
+        await db.close_db()